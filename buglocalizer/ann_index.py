@@ -0,0 +1,194 @@
+import hashlib
+import time
+
+import numpy as np
+from scipy import sparse
+
+# Number of vectors assigned to the nearest centroids at once
+_BLOCK_SIZE = 65536
+
+
+def normalize_rows(vectors):
+    """Scaling vectors to unit length, leaving zero vectors as they are"""
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors),
+                     where=norms > 0)
+
+
+def _nearest_centroids(vectors, centroids):
+    """Index of the most similar centroid of each vector"""
+
+    assignment = np.empty(len(vectors), dtype=np.intp)
+    for start in range(0, len(vectors), _BLOCK_SIZE):
+        block = vectors[start:start + _BLOCK_SIZE]
+        assignment[start:start + _BLOCK_SIZE] = np.argmax(
+            block @ centroids.T, axis=1)
+
+    return assignment
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter, rng):
+    """Clustering unit vectors by their cosine similarity"""
+
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+
+    for _ in range(n_iter):
+        assignment = _nearest_centroids(vectors, centroids)
+
+        # Summing the members of each cluster with a one-hot matrix
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(vectors)), (assignment, np.arange(len(vectors)))),
+            shape=(n_lists, len(vectors))
+        )
+        sums = one_hot @ vectors
+
+        # Empty clusters keep their previous centroid
+        empty = np.asarray(one_hot.sum(axis=1)).ravel() == 0
+        sums[empty] = centroids[empty]
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+
+def vectors_digest(vectors):
+    """Hash of the unit vectors an index is built on"""
+
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+    return hashlib.sha1(np.ascontiguousarray(vectors)).hexdigest()
+
+
+class IVFIndex:
+    """Inverted file index over document vectors for approximate
+    cosine similarity search.
+    """
+
+    __slots__ = ['centroids', 'list_offsets', 'list_ids', 'vectors', 'digest']
+
+    def __init__(self, centroids, list_offsets, list_ids, vectors, digest=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.vectors = vectors
+        self.digest = digest
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_iter=20, sample_size=256, seed=0):
+        """Clustering the vectors and grouping them by their nearest centroid"""
+
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        rng = np.random.default_rng(seed)
+
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        # Training the centroids on a sample of the vectors
+        n_train = min(len(vectors), n_lists * sample_size)
+        train = vectors[rng.choice(len(vectors), n_train, replace=False)]
+        centroids = _spherical_kmeans(train, n_lists, n_iter, rng)
+
+        assignment = _nearest_centroids(vectors, centroids)
+        list_ids = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+
+        # Vectors are stored in the order of their lists
+        return cls(centroids, list_offsets, list_ids, vectors[list_ids],
+                   vectors_digest(vectors))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['list_offsets'],
+                       data['list_ids'], data['vectors'],
+                       str(data['digest']) if 'digest' in data else None)
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, list_offsets=self.list_offsets,
+                 list_ids=self.list_ids, vectors=self.vectors, digest=self.digest)
+
+    def __len__(self):
+        return len(self.list_ids)
+
+    def search(self, query, k, n_probe=8):
+        """Finding the k most similar vectors to the query among the
+        lists of its n_probe nearest centroids.
+        """
+
+        query = normalize_rows(np.asarray(query, dtype=np.float32)[None])[0]
+
+        n_probe = min(n_probe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+
+        positions = np.concatenate(
+            [np.arange(self.list_offsets[i], self.list_offsets[i + 1])
+             for i in probed])
+        simis = self.vectors[positions] @ query
+
+        if len(positions) > k:
+            top = np.argpartition(-simis, k - 1)[:k]
+        else:
+            top = np.arange(len(positions))
+        top = top[np.argsort(-simis[top], kind='stable')]
+
+        return self.list_ids[positions[top]], simis[top]
+
+
+def exact_search(vectors, query, k):
+    """Brute-force k most similar unit vectors to the unit query"""
+
+    simis = vectors @ query
+    top = np.argpartition(-simis, min(k, len(simis)) - 1)[:k]
+    top = top[np.argsort(-simis[top], kind='stable')]
+
+    return top, simis[top]
+
+
+def benchmark(index, vectors, queries, k=100, n_probes=(1, 2, 4, 8, 16, 32)):
+    """Recall of the index against exact search and its speedup
+    for different numbers of probed lists.
+    """
+
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    queries = normalize_rows(np.asarray(queries, dtype=np.float32))
+
+    start = time.perf_counter()
+    exact = [set(exact_search(vectors, query, k)[0].tolist()) for query in queries]
+    exact_time = time.perf_counter() - start
+
+    results = []
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        found = [index.search(query, k, n_probe)[0] for query in queries]
+        ann_time = time.perf_counter() - start
+
+        recall = np.mean([len(truth.intersection(ids.tolist())) / len(truth)
+                          for truth, ids in zip(exact, found)])
+        results.append((n_probe, recall, exact_time / ann_time))
+
+    return results
+
+
+def main():
+    import artifacts
+    import semantic_similarity
+
+    src_files = artifacts.load('preprocessed_src')
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    vectorizer = semantic_similarity.load_vectorizer(src_files, bug_reports)
+    src_vectors = semantic_similarity.src_vectors(vectorizer, src_files)
+    report_vectors = semantic_similarity.report_vectors(vectorizer, bug_reports)
+
+    index = semantic_similarity.load_ann_index(src_vectors)
+
+    print(f'{len(index)} vectors in {len(index.centroids)} lists')
+    for n_probe, recall, speedup in benchmark(index, src_vectors, report_vectors,
+                                              semantic_similarity.ANN_TOP_K):
+        print(f'n_probe: {n_probe}, recall: {recall:.4f}, speedup: {speedup:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
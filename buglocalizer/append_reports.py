@@ -0,0 +1,123 @@
+import json
+from collections import OrderedDict
+
+import artifacts
+import cascade
+import duplicates
+import evaluation
+import fixed_bug_reports
+import score_store
+import semantic_similarity
+from datasets import DATASET
+from parsers import Parser
+from preprocessing import ReportPreprocessing
+from stack_trace import TraceIndex
+from token_matching import TokenIndex
+from vsm_similarity import Similarity
+
+
+def new_reports(bug_reports):
+    """Bug reports of the repository which aren't preprocessed yet"""
+
+    parser = Parser(DATASET)
+
+    return OrderedDict((bug_id, report) for bug_id, report
+                       in parser.report_parser().items()
+                       if bug_id not in bug_reports)
+
+
+def append(src_files, bug_reports, reports):
+    """Scoring new reports against the existing source files and
+    appending their rows to the stored scores.
+    """
+
+    report_prep = ReportPreprocessing(reports)
+    report_prep.preprocess()
+
+    # Exact duplicates of localized reports are not scored, and near
+    # duplicates are only scored by the cheap scorers
+    matches = OrderedDict()
+    if duplicates.USE_DUPLICATES:
+        duplicate_index = duplicates.DuplicateIndex.load(bug_reports)
+        matches = duplicate_index.matches(reports)
+    scored = OrderedDict((bug_id, report) for bug_id, report in reports.items()
+                         if not matches.get(bug_id, (None, False))[1])
+    unmatched = OrderedDict((bug_id, report) for bug_id, report in reports.items()
+                            if bug_id not in matches)
+
+    def merge_rows(name, scored_reports, rows):
+        return duplicates.merge_rows(name, reports, scored_reports, rows, matches, bug_reports)
+
+    token_matching_score = merge_rows(
+        'token_matching', scored, TokenIndex.load(src_files).check_matchings(scored))
+    vsm_similarity_score = merge_rows(
+        'vsm_similarity', scored, Similarity.load(src_files).find_similars(scored))
+    stack_trace_score = merge_rows(
+        'stack_trace', scored, TraceIndex.load(src_files).get_traces_score(scored))
+
+    shortlist = unmatched_shortlist = None
+    if cascade.USE_CASCADE:
+        shortlist = cascade.shortlist(cascade.SHORTLIST_SIZE, token_matching_score,
+                                      vsm_similarity_score, stack_trace_score)
+        cascade.append_shortlist(shortlist)
+        unmatched_shortlist = shortlist[[i for i, bug_id in enumerate(reports)
+                                         if bug_id in unmatched]]
+
+    semantic_similarity_score = merge_rows(
+        'semantic_similarity', unmatched,
+        semantic_similarity.calculate_similarity(src_files, unmatched, unmatched_shortlist)
+        if unmatched else [])
+
+    # Duplicates are not classified, but they're learned in their order
+    # as previously fixed bugs of the later reports. The incremental model
+    # learns the new reports instead of refitting on the whole history
+    fixed_bug_reports_score = merge_rows(
+        'fixed_bug_reports', unmatched,
+        list(fixed_bug_reports.iter_model_clf(reports, shortlist, history=bug_reports,
+                                              save_model=True, skipped=matches)))
+
+    score_store.append_scores('token_matching', token_matching_score)
+    score_store.append_scores('vsm_similarity', vsm_similarity_score)
+    score_store.append_scores('stack_trace', stack_trace_score)
+    score_store.append_scores('semantic_similarity', semantic_similarity_score)
+    score_store.append_scores('fixed_bug_reports', fixed_bug_reports_score)
+
+    if duplicates.USE_DUPLICATES:
+        n_exact = len(reports) - len(scored)
+        print(f'Reused scores of {n_exact} exact and {len(matches) - n_exact} '
+              f'near duplicate reports')
+        duplicate_index.update(reports)
+        duplicate_index.save()
+
+    bug_reports.update(reports)
+    artifacts.save('preprocessed_reports', bug_reports)
+
+    return (vsm_similarity_score, token_matching_score, fixed_bug_reports_score,
+            semantic_similarity_score, stack_trace_score)
+
+
+def main():
+
+    src_files = artifacts.load('preprocessed_src')
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    reports = new_reports(bug_reports)
+    if not reports:
+        print('No new bug reports')
+        return
+
+    rank_scores = append(src_files, bug_reports, reports)
+
+    # Ranking new reports with the last estimated parameters
+    with open(DATASET.root / 'params.json', 'r') as file:
+        params = json.load(file)
+
+    evaluation.write_ranks(list(reports), list(src_files),
+                           evaluation.final_blocks(params, rank_scores),
+                           name='appended_output')
+
+    print(f'Appended {len(reports)} bug reports')
+
+
+if __name__ == '__main__':
+    main()
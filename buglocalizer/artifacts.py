@@ -0,0 +1,36 @@
+import pickle
+
+from datasets import DATASET
+
+# Artifacts loaded or saved in this process, so the stages running
+# together in the pipeline don't unpickle them again
+_artifacts = {}
+
+
+def load(name):
+    """Loading a pickled artifact of the dataset"""
+
+    path = DATASET.root / f'{name}.pickle'
+
+    if path not in _artifacts:
+        with open(path, 'rb') as file:
+            _artifacts[path] = pickle.load(file)
+
+    return _artifacts[path]
+
+
+def cached(name):
+    """The artifact if it's already loaded or saved in this process"""
+
+    return _artifacts.get(DATASET.root / f'{name}.pickle')
+
+
+def save(name, artifact):
+    """Pickling an artifact of the dataset and keeping it in memory"""
+
+    path = DATASET.root / f'{name}.pickle'
+
+    with open(path, 'wb') as file:
+        pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    _artifacts[path] = artifact
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+
+import artifacts
+import score_store
+from datasets import DATASET
+
+# Scoring source files with semantic similarity and fixed bug reports
+# only if cheap scorers put them in the shortlist of a report
+USE_CASCADE = False
+
+# Number of candidate source files kept for each report
+SHORTLIST_SIZE = 300
+
+
+def shortlist(size, *cheap_scores):
+    """Picking the top candidate source files of each report based on
+    the sum of cheap scores.
+    """
+
+    total = sum(np.asarray(scores, dtype=float) for scores in cheap_scores)
+    size = min(size, total.shape[1])
+
+    candidates = np.argpartition(-total, size - 1, axis=1)[:, :size]
+
+    # Keeping the candidates in the order of source files
+    return np.sort(candidates, axis=1)
+
+
+def save_shortlist(size=SHORTLIST_SIZE):
+
+    candidates = [shortlist(size, *cheap_scores) for _, cheap_scores in
+                  score_store.iter_blocks(('token_matching', 'vsm_similarity', 'stack_trace'))]
+    np.save(DATASET.root / 'shortlist.npy', np.concatenate(candidates))
+
+
+def append_shortlist(candidates):
+    np.save(DATASET.root / 'shortlist.npy',
+            np.concatenate((load_shortlist(), candidates)))
+
+
+def load_shortlist():
+    return np.load(DATASET.root / 'shortlist.npy')
+
+
+def benchmark(size=SHORTLIST_SIZE):
+    """Comparing the latency and accuracy of the cascade against
+    scoring all source files.
+    """
+
+    import evaluation
+    import fixed_bug_reports
+    import semantic_similarity
+
+    src_files = artifacts.load('preprocessed_src')
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    cheap_scores = [score_store.load_scores(name) for name in
+                    ('vsm_similarity', 'token_matching', 'stack_trace')]
+    vsm_score, token_score, trace_score = cheap_scores
+
+    start = time.perf_counter()
+    candidates = shortlist(size, *cheap_scores)
+    shortlist_time = time.perf_counter() - start
+
+    results = {}
+    for name, cands in (('full', None), ('cascade', candidates)):
+        start = time.perf_counter()
+        semantic_score = semantic_similarity.calculate_similarity(
+            src_files, bug_reports, cands)
+        fixed_score = fixed_bug_reports.prepare_clf(bug_reports, cands)
+        elapsed = time.perf_counter() - start
+
+        rank_scores = (vsm_score, token_score, fixed_score,
+                       semantic_score, trace_score)
+        params = evaluation.estiamte_params(src_files, bug_reports, *rank_scores)
+
+        mrr, mean_avgp, *_ = evaluation.block_metrics(
+            evaluation.relevant_files(src_files, bug_reports),
+            evaluation.final_blocks(params, rank_scores))
+
+        results[name] = (elapsed, np.mean(mrr), np.mean(mean_avgp))
+
+    full_time, full_mrr, full_map = results['full']
+    cascade_time, cascade_mrr, cascade_map = results['cascade']
+    cascade_time += shortlist_time
+
+    print(f'Shortlist size: {candidates.shape[1]} of {len(src_files)} files')
+    print(f'Expensive scorers time: {full_time:.2f}s -> {cascade_time:.2f}s '
+          f'({full_time - cascade_time:.2f}s saved)')
+    print(f'MRR: {full_mrr:.4f} -> {cascade_mrr:.4f}')
+    print(f'MAP: {full_map:.4f} -> {cascade_map:.4f}')
+
+
+def main():
+    save_shortlist()
+
+
+if __name__ == '__main__':
+    main()
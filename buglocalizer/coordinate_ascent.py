@@ -0,0 +1,229 @@
+import time
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+import artifacts
+import corpus_store
+import evaluation
+
+# Largest number of passes over all coefficients
+MAX_SWEEPS = 20
+
+# Value of all coefficients when the search isn't started from given ones
+INITIAL_COEFF = 0.5
+
+# Number of searches started from random coefficients after the first one,
+# as coordinate ascent stops at local optima
+N_RESTARTS = 5
+
+SEED = 458711526
+
+# Smallest improvement of the objective for which a coefficient is changed
+_TOLERANCE = 1e-12
+
+# Number of relevant files whose crossings are found together to bound the memory
+_BLOCK_SIZE = 256
+
+
+def _crossings(base, slope, rows, cols):
+    """Ranks of relevant files when the coefficient is just above zero,
+    and the points in (0, 1) where other files cross them, with the change
+    of their rank (+1 when a file overtakes them and -1 when they overtake
+    a file).
+    """
+
+    src_range = np.arange(base.shape[1])
+
+    ranks = np.empty(len(rows))
+    points, changes, relevant = [], [], []
+    for start in range(0, len(rows), _BLOCK_SIZE):
+        block_rows = rows[start:start + _BLOCK_SIZE]
+        block_cols = cols[start:start + _BLOCK_SIZE]
+        positions = np.arange(len(block_rows))
+
+        b, s = base[block_rows], slope[block_rows]
+        target_b = b[positions, block_cols][:, None]
+        target_s = s[positions, block_cols][:, None]
+
+        # Files are ordered by their score at zero, then by their slope,
+        # and ties keep the order of source files like a stable sort
+        ahead = (b > target_b) | ((b == target_b) & (
+            (s > target_s) | ((s == target_s) & (src_range < block_cols[:, None]))))
+        ranks[start:start + len(block_rows)] = ahead.sum(axis=1) + 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_points = (b - target_b) / (target_s - s)
+        i, k = np.nonzero((crossing_points > 0) & (crossing_points < 1))
+
+        points.append(crossing_points[i, k])
+        changes.append(np.where(s[i, k] > target_s[i, 0], 1, -1))
+        relevant.append(start + i)
+
+    return ranks, np.concatenate(points), np.concatenate(changes), np.concatenate(relevant)
+
+
+def _report_objective(ranks):
+    """Reciprocal rank plus average precision of each row of ranks of
+    the relevant files of a report.
+    """
+
+    ranks = np.sort(ranks, axis=1)
+    positions = np.arange(1, ranks.shape[1] + 1)
+
+    return 1 / ranks[:, 0] + (positions / ranks).mean(axis=1)
+
+
+def line_search(coeffs, j, relevance, rank_scores):
+    """The best value of a coefficient with the others fixed, where the
+    objective (MRR plus MAP) is piecewise constant and only changes at the
+    points where a relevant file swaps its rank with another file. All
+    points in [0, 1] are found and swept, returning the middle of the best
+    interval between them with its objective.
+    """
+
+    n_reports = len(relevance[2])
+    others = np.array(coeffs, dtype=float)
+    others[j] = 0
+
+    ranks, points, changes, relevant, report_rows = [], [], [], [], []
+    for start, scores in evaluation.score_blocks(rank_scores):
+        rows, cols, _ = evaluation.slice_relevance(relevance, start, start + len(scores[0]))
+        block_ranks, block_points, block_changes, block_relevant = _crossings(
+            evaluation.combine_rank_scores(others, *scores, dtype='float64'),
+            np.asarray(scores[j], dtype=float), rows, cols)
+
+        ranks.append(block_ranks)
+        points.append(block_points)
+        changes.append(block_changes)
+        relevant.append(block_relevant + sum(map(len, report_rows)))
+        report_rows.append(rows + start)
+
+    ranks, points, changes, relevant, rows = map(
+        np.concatenate, (ranks, points, changes, relevant, report_rows))
+
+    # Objective of reports before any crossing
+    first_relevant = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    n_relevant = np.diff(np.r_[first_relevant, len(rows)])
+    objective = sum(
+        _report_objective(ranks[first_relevant[n_relevant == n][:, None] + np.arange(n)]).sum()
+        for n in np.unique(n_relevant)) / n_reports
+
+    # Following the ranks of each report through its crossings in order
+    # to find the change of objective at each crossing, together for the
+    # reports with the same number of relevant files
+    point_order = np.argsort(points)
+    order = point_order[np.argsort(rows[relevant][point_order], kind='stable')]
+    changes, relevant = changes[order], relevant[order]
+    gains = np.empty(len(points))
+
+    first = first_relevant[np.searchsorted(rows[first_relevant], rows[relevant])]
+    new_report = np.r_[True, first[1:] != first[:-1]]
+    n_event_relevant = n_relevant[np.searchsorted(first_relevant, first)]
+
+    for n in np.unique(n_event_relevant):
+        events = np.flatnonzero(n_event_relevant == n)
+
+        steps = np.zeros((len(events), n))
+        steps[np.arange(len(events)), relevant[events] - first[events]] = changes[events]
+
+        # Steps are summed from the first crossing of each report
+        totals = np.cumsum(steps, axis=0)
+        report_start = np.maximum.accumulate(
+            np.where(new_report[events], np.arange(len(events)), 0))
+        totals -= totals[report_start] - steps[report_start]
+
+        report_ranks = ranks[first[events][:, None] + np.arange(n)] + totals
+        gains[order[events]] = (_report_objective(report_ranks)
+                                - _report_objective(report_ranks - steps)) / n_reports
+
+    # Objective of each interval between the distinct crossing points
+    points, gains = points[point_order], gains[point_order]
+    last_at_point = np.flatnonzero(np.r_[points[1:] != points[:-1], True])
+
+    objectives = np.r_[objective, objective + np.cumsum(gains)[last_at_point]]
+    bounds = np.r_[0, points[last_at_point], 1]
+
+    best = np.argmax(objectives)
+
+    return (bounds[best] + bounds[best + 1]) / 2, objectives[best]
+
+
+def ascend(coeffs, relevance, rank_scores, max_sweeps=MAX_SWEEPS):
+    """Maximizing MRR plus MAP by exact line searches of one coefficient
+    at a time, until no coefficient improves it. Returns the coefficients,
+    their objective and the number of line searches.
+    """
+
+    coeffs = np.array(coeffs, dtype=float)
+    best = -evaluation.cost(coeffs, relevance, *rank_scores)
+
+    n_searches = 0
+    for _ in range(max_sweeps):
+        improved = False
+        for j in range(len(coeffs)):
+            value, objective = line_search(coeffs, j, relevance, rank_scores)
+            n_searches += 1
+            if objective > best + _TOLERANCE:
+                coeffs[j], best, improved = value, objective, True
+
+        if not improved:
+            break
+
+    return coeffs, best, n_searches
+
+
+def fit_params(relevance, rank_scores, x0=None, n_restarts=N_RESTARTS):
+    """Coordinate ascent from the given or equal coefficients and from
+    random ones, keeping the best.
+    """
+
+    rng = np.random.default_rng(SEED)
+    starts = [np.full(len(rank_scores), INITIAL_COEFF) if x0 is None else x0]
+    starts += list(rng.random((n_restarts, len(rank_scores))))
+
+    best_coeffs, best, nfev = None, -np.inf, 0
+    for start in starts:
+        coeffs, objective, n_searches = ascend(start, relevance, rank_scores)
+
+        # Each line search is one pass over the scores like a cost evaluation
+        nfev += n_searches + 1
+        if objective > best:
+            best_coeffs, best = coeffs, objective
+
+    return OptimizeResult(x=best_coeffs, fun=evaluation.cost(best_coeffs, relevance, *rank_scores),
+                          nit=len(starts), nfev=nfev + 1, success=True)
+
+
+def benchmark(src_files, bug_reports, *rank_scores):
+    """Comparing differential evolution and coordinate ascent on the
+    passes over the scores, time and the final MRR and MAP.
+    """
+
+    relevance = evaluation.relevant_files(src_files, bug_reports)
+
+    for name, fit in (('de', evaluation.fit_params), ('coordinate', fit_params)):
+        start = time.perf_counter()
+        res = fit(relevance, rank_scores)
+        elapsed = time.perf_counter() - start
+
+        mrr, mean_avgp, *_ = evaluation.block_metrics(
+            relevance, evaluation.final_blocks(res.x, rank_scores))
+
+        print(f'{name}: {res.nfev} evaluations, {elapsed:.2f}s, '
+              f'MRR {np.mean(mrr):.4f}, MAP {np.mean(mean_avgp):.4f}, '
+              f'params {np.round(res.x, 4).tolist()}')
+
+
+def main():
+    # Only the ids of source files are needed
+    src_files = corpus_store.load_src([])
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    benchmark(src_files, bug_reports, *evaluation.load_rank_scores(
+        'vsm_similarity', 'token_matching', 'fixed_bug_reports',
+        'semantic_similarity', 'stack_trace'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import itertools
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+import artifacts
+from datasets import DATASET
+from parsers import SourceFile
+
+# Token fields of preprocessed source files, each one stored as a
+# column of stemmed and a column of unstemmed tokens
+TOKEN_FIELDS = ['all_content', 'comments', 'class_names', 'attributes',
+                'method_names', 'variables', 'file_name', 'pos_tagged_comments']
+VARIANTS = ['stemmed', 'unstemmed']
+
+# Fields with a single name for each source file
+NAME_FIELDS = ['exact_file_name', 'package_name']
+
+
+def _store_dir():
+    return DATASET.root / 'preprocessed_src'
+
+
+def _save_tokens(column_dir, docs):
+    """Saving token lists as token ids of the column vocabulary
+    and the offsets of documents.
+    """
+
+    column_dir.mkdir(parents=True)
+
+    vocabulary = {}
+    tokens = [vocabulary.setdefault(token, len(vocabulary))
+              for doc in docs for token in doc]
+
+    np.save(column_dir / 'vocab.npy', np.array(list(vocabulary), dtype=str))
+    np.save(column_dir / 'tokens.npy', np.array(tokens, dtype=np.int32))
+    np.save(column_dir / 'offsets.npy', np.cumsum([0] + [len(doc) for doc in docs]))
+
+
+def _load_tokens(column_dir, first=0, last=None):
+    """Token lists of the documents from the first to the last one"""
+
+    vocab = np.load(column_dir / 'vocab.npy', mmap_mode='r')
+    offsets = np.load(column_dir / 'offsets.npy', mmap_mode='r')
+    offsets = offsets[first:None if last is None else last + 1].tolist()
+    tokens = vocab[np.load(column_dir / 'tokens.npy', mmap_mode='r')
+                   [offsets[0]:offsets[-1]]].tolist()
+
+    return [tokens[start - offsets[0]:stop - offsets[0]]
+            for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def save_src(src_files):
+    """Saving preprocessed source files as a column for each field
+    (and each variant of token fields).
+    """
+
+    store = _store_dir()
+    shutil.rmtree(store, ignore_errors=True)
+    store.mkdir(parents=True)
+
+    np.save(store / 'keys.npy', np.array(list(src_files), dtype=str))
+    np.save(store / 'exact_file_name.npy',
+            np.array([src.exact_file_name for src in src_files.values()], dtype=str))
+    # Files without a package are saved with an empty name
+    np.save(store / 'package_name.npy',
+            np.array([src.package_name or '' for src in src_files.values()], dtype=str))
+
+    for field in TOKEN_FIELDS:
+        for variant in VARIANTS:
+            _save_tokens(store / f'{field}.{variant}',
+                         [getattr(src, field)[variant] for src in src_files.values()])
+
+
+def n_src():
+    """Number of stored source files"""
+
+    return len(np.load(_store_dir() / 'keys.npy', mmap_mode='r'))
+
+
+def load_src(columns, first=0, last=None):
+    """Loading preprocessed source files with only the given columns,
+    like 'package_name' or 'file_name.stemmed', unless all of them are
+    already loaded in this process. Only the files from the first to
+    the last one are loaded if they're given, like a shard of the files.
+    """
+
+    src_files = artifacts.cached('preprocessed_src')
+    if src_files is not None:
+        if first == 0 and last is None:
+            return src_files
+        return OrderedDict(itertools.islice(src_files.items(), first, last))
+
+    store = _store_dir()
+    rows = slice(first, last)
+
+    src_keys = np.load(store / 'keys.npy', mmap_mode='r')[rows].tolist()
+    src_files = OrderedDict((src_id, SourceFile.__new__(SourceFile)) for src_id in src_keys)
+
+    for column in columns:
+        if column in NAME_FIELDS:
+            names = np.load(store / f'{column}.npy', mmap_mode='r')[rows].tolist()
+            for src, name in zip(src_files.values(), names):
+                setattr(src, column, (name or None) if column == 'package_name' else name)
+            continue
+
+        field, variant = column.split('.')
+        for src, doc in zip(src_files.values(), _load_tokens(store / column, first, last)):
+            if getattr(src, field, None) is None:
+                setattr(src, field, {})
+            getattr(src, field)[variant] = doc
+
+    return src_files
@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import artifacts
+import corpus_store
+import evaluation
+import score_store
+
+# Number of folds of later reports evaluated with parameters
+# fitted on the earlier ones
+N_FOLDS = 5
+
+# Number of folds before a fold which its parameters are fitted on
+# (None fits on all the earlier reports)
+WINDOW = None
+
+# Number of worker processes running the folds
+N_WORKERS = os.cpu_count()
+
+SCORERS = ('vsm_similarity', 'token_matching', 'fixed_bug_reports',
+           'semantic_similarity', 'stack_trace')
+
+
+def chronological_folds(n_reports, n_folds=N_FOLDS, window=WINDOW):
+    """Report ranges of the train and test set of each fold, where
+    reports are in the order they were reported.
+    """
+
+    sizes = [len(part) for part in np.array_split(np.arange(n_reports), n_folds + 1)]
+    bounds = np.cumsum([0] + sizes).tolist()
+
+    folds = []
+    for i in range(1, n_folds + 1):
+        train_start = bounds[0 if window is None else max(0, i - window)]
+        folds.append(((train_start, bounds[i]), (bounds[i], bounds[i + 1])))
+
+    return folds
+
+
+def run_fold(relevance, train, test):
+    """Fitting parameters on the train reports with the configured
+    optimizer, without warm starts or saving the estimation, and evaluating
+    them on the test reports. Scores are read block by block from the
+    memory-mapped store, which all folds share.
+    """
+
+    start = time.perf_counter()
+    train_scores = [score_store.RowRange(name, *train) for name in SCORERS]
+    params = evaluation.search_params(evaluation.slice_relevance(relevance, *train),
+                                      train_scores).x.tolist()
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    test_scores = [score_store.RowRange(name, *test) for name in SCORERS]
+    mrr, mean_avgp, hits, *_ = evaluation.block_metrics(
+        evaluation.slice_relevance(relevance, *test),
+        evaluation.final_blocks(params, test_scores))
+    eval_time = time.perf_counter() - start
+
+    return params, fit_time, eval_time, mrr, mean_avgp, hits
+
+
+def cross_validate(relevance, folds, n_workers=None):
+    """Running the folds concurrently (in N_WORKERS processes by default)"""
+
+    n_workers = N_WORKERS if n_workers is None else n_workers
+    trains, tests = zip(*folds)
+
+    if n_workers <= 1:
+        return list(map(run_fold, [relevance] * len(folds), trains, tests))
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        return list(executor.map(run_fold, [relevance] * len(folds), trains, tests))
+
+
+def main():
+    # Only the ids of source files are needed
+    src_files = corpus_store.load_src([])
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    relevance = evaluation.relevant_files(src_files, bug_reports)
+    folds = chronological_folds(len(bug_reports))
+
+    start = time.perf_counter()
+    results = cross_validate(relevance, folds)
+    elapsed = time.perf_counter() - start
+
+    for ((train, test), (params, fit_time, eval_time, mrr, mean_avgp, hits)) in zip(folds, results):
+        print(f'Train {train[0]}-{train[1]}, test {test[0]}-{test[1]}: '
+              f'fit {fit_time:.2f}s, evaluation {eval_time:.2f}s, '
+              f'MRR {np.mean(mrr):.4f}, MAP {np.mean(mean_avgp):.4f}, '
+              f'Top N Rank % {(hits > 0).mean(axis=0).round(4).tolist()}, '
+              f'params {np.round(params, 4).tolist()}')
+
+    # Aggregating over all test reports
+    _, _, _, mrr, mean_avgp, hits = zip(*results)
+    mrr, mean_avgp, hits = np.concatenate(mrr), np.concatenate(mean_avgp), np.concatenate(hits)
+    print(f'All folds: {elapsed:.2f}s, MRR {np.mean(mrr):.4f}, MAP {np.mean(mean_avgp):.4f}, '
+          f'Top N Rank % {(hits > 0).mean(axis=0).round(4).tolist()}')
+
+
+if __name__ == '__main__':
+    main()
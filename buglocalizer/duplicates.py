@@ -0,0 +1,261 @@
+import hashlib
+import json
+import pickle
+import time
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.utils import murmurhash3_32
+
+import artifacts
+import evaluation
+import score_store
+from datasets import DATASET
+
+# Reusing the scores of localized reports for new reports duplicating them,
+# all scores of exact duplicates and the expensive ones of near duplicates
+USE_DUPLICATES = False
+
+# Smallest estimated Jaccard similarity of the token sets of near duplicates
+THRESHOLD = 0.9
+
+# Number of MinHash functions, split into bands of rows which are
+# hashed to find candidate near duplicates
+N_BANDS = 32
+N_ROWS = 4
+
+SEED = 458711526
+
+# Scorers which are only computed for reports that aren't duplicates
+EXPENSIVE_SCORERS = ('semantic_similarity', 'fixed_bug_reports')
+
+# Mersenne prime of the universal hash functions
+_PRIME = (1 << 61) - 1
+
+_rng = np.random.default_rng(SEED)
+_A = _rng.integers(1, 1 << 32, N_BANDS * N_ROWS, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, N_BANDS * N_ROWS, dtype=np.uint64)
+
+
+def report_tokens(report):
+    return report.summary['stemmed'] + report.description['stemmed']
+
+
+def exact_fingerprint(report):
+    """Hash of the token bag and stack traces of a report"""
+
+    fingerprint = hashlib.sha1()
+    fingerprint.update(' '.join(sorted(report_tokens(report))).encode())
+    fingerprint.update(repr(report.stack_traces).encode())
+
+    return fingerprint.hexdigest()
+
+
+def minhash(tokens):
+    """MinHash signature of a set of tokens"""
+
+    hashes = np.array([murmurhash3_32(token, positive=True) for token in set(tokens)],
+                      dtype=np.uint64)
+
+    return ((hashes * _A[:, None] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def _bands(signature):
+    return [(i, signature[i * N_ROWS:(i + 1) * N_ROWS].tobytes()) for i in range(N_BANDS)]
+
+
+class DuplicateIndex:
+    """Exact fingerprints and MinHash signatures of localized bug reports,
+    with locality-sensitive hashing buckets of signature bands to find
+    near duplicates of new reports.
+    """
+
+    INDEX_FILE = 'duplicate_index.pickle'
+
+    __slots__ = ['bug_ids', 'exact', 'signatures', 'buckets']
+
+    def __init__(self, bug_reports):
+        self.bug_ids = []
+        self.exact = {}
+        self.signatures = OrderedDict()
+        self.buckets = {}
+        self.update(bug_reports)
+
+    def update(self, bug_reports):
+        """Adding localized reports"""
+
+        for bug_id, report in bug_reports.items():
+            self.bug_ids.append(bug_id)
+            self.exact[exact_fingerprint(report)] = bug_id
+
+            tokens = report_tokens(report)
+            if not tokens:
+                continue
+
+            signature = minhash(tokens)
+            self.signatures[bug_id] = signature
+            for band in _bands(signature):
+                self.buckets.setdefault(band, []).append(bug_id)
+
+    def find(self, report, threshold=THRESHOLD):
+        """The most similar localized report duplicated by a report, and
+        whether it's an exact duplicate, or None if there isn't one.
+        """
+
+        bug_id = self.exact.get(exact_fingerprint(report))
+        if bug_id is not None:
+            return bug_id, True
+
+        tokens = report_tokens(report)
+        if not tokens:
+            return None
+
+        signature = minhash(tokens)
+        candidates = dict.fromkeys(candidate for band in _bands(signature)
+                                   for candidate in self.buckets.get(band, ()))
+
+        best, best_similarity = None, threshold
+        for candidate in candidates:
+            similarity = np.mean(self.signatures[candidate] == signature)
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+
+        return None if best is None else (best, False)
+
+    def matches(self, bug_reports):
+        """Localized reports duplicated by the given reports"""
+
+        matches = OrderedDict()
+        for bug_id, report in bug_reports.items():
+            match = self.find(report)
+            if match is not None:
+                matches[bug_id] = match
+
+        return matches
+
+    def save(self):
+        with open(DATASET.root / self.INDEX_FILE, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, bug_reports):
+        """Loading the saved index, building it if there isn't one
+        for the given localized reports.
+        """
+
+        index_path = DATASET.root / cls.INDEX_FILE
+
+        if index_path.exists():
+            with open(index_path, 'rb') as file:
+                index = pickle.load(file)
+            if index.bug_ids == list(bug_reports):
+                return index
+
+        index = cls(bug_reports)
+        index.save()
+
+        return index
+
+
+def merge_rows(name, reports, scored_reports, scored_rows, matches, bug_reports):
+    """Score rows of a scorer for reports, where the reports which aren't
+    scored take the stored rows of the localized reports they duplicate.
+    """
+
+    rows = dict(zip(scored_reports, scored_rows))
+
+    copied = [bug_id for bug_id in reports if bug_id not in rows]
+    if copied:
+        positions = {bug_id: i for i, bug_id in enumerate(bug_reports)}
+        store_rows = np.array([positions[matches[bug_id][0]] for bug_id in copied])
+        unique, inverse = np.unique(store_rows, return_inverse=True)
+        rows.update(zip(copied, score_store.take_rows(name, unique)[inverse]))
+
+    return [rows[bug_id] for bug_id in reports]
+
+
+def benchmark():
+    """Replaying the localized reports in their order to find the ones
+    duplicating earlier reports, with the hit rates, the scoring time
+    saved by reusing scores and the change of MRR and MAP on the hits.
+    """
+
+    import fixed_bug_reports
+    import semantic_similarity
+    from stack_trace import TraceIndex
+    from token_matching import TokenIndex
+    from vsm_similarity import Similarity
+
+    src_files = artifacts.load('preprocessed_src')
+    bug_reports = artifacts.load('preprocessed_reports')
+    bug_ids = list(bug_reports)
+
+    with open(DATASET.root / 'params.json', 'r') as file:
+        params = json.load(file)
+
+    index = DuplicateIndex({})
+    matches = OrderedDict()
+    start = time.perf_counter()
+    for bug_id, report in bug_reports.items():
+        match = index.find(report)
+        if match is not None:
+            matches[bug_id] = match
+        index.update({bug_id: report})
+    lookup_time = (time.perf_counter() - start) / len(bug_reports)
+
+    n_exact = sum(exact for _, exact in matches.values())
+    print(f'{len(bug_reports)} reports, {n_exact} exact and {len(matches) - n_exact} near '
+          f'duplicates ({len(matches) / len(bug_reports):.2%} hit rate), '
+          f'lookup {lookup_time * 1000:.2f}ms per report')
+    if not matches:
+        return
+
+    hits = OrderedDict((bug_id, bug_reports[bug_id]) for bug_id in matches)
+    positions = {bug_id: i for i, bug_id in enumerate(bug_ids)}
+    rows = np.array([positions[bug_id] for bug_id in hits])
+    matched_rows = np.array([positions[bug_id] for bug_id, _ in matches.values()])
+    exact = np.array([exact for _, exact in matches.values()])
+
+    # Time of the scorers for the reports which are reused instead
+    timings = {}
+    for name, score in (
+            ('vsm_similarity', lambda: Similarity.load(src_files).find_similars(hits)),
+            ('token_matching', lambda: TokenIndex.load(src_files).check_matchings(hits)),
+            ('fixed_bug_reports', lambda: fixed_bug_reports.prepare_clf(
+                hits, history=OrderedDict((b, bug_reports[b]) for b in bug_ids[:rows[0]]))),
+            ('semantic_similarity', lambda: semantic_similarity.calculate_similarity(
+                src_files, hits)),
+            ('stack_trace', lambda: TraceIndex.load(src_files).get_traces_score(hits))):
+        start = time.perf_counter()
+        score()
+        timings[name] = (time.perf_counter() - start) / len(hits)
+
+    saved = sum(timings.values()) * n_exact + sum(
+        timings[name] for name in EXPENSIVE_SCORERS) * (len(matches) - n_exact)
+    print(f'Scoring time saved: {saved:.2f}s, {saved / len(matches) * 1000:.1f}ms per hit')
+
+    # Ranking the hits with their own scores and with the reused ones
+    names = ('vsm_similarity', 'token_matching', 'fixed_bug_reports',
+             'semantic_similarity', 'stack_trace')
+    own = [score_store.take_rows(name, rows) for name in names]
+
+    reused = []
+    for name, scores in zip(names, own):
+        unique, inverse = np.unique(matched_rows, return_inverse=True)
+        matched = score_store.take_rows(name, unique)[inverse]
+        copied = exact | (name in EXPENSIVE_SCORERS)
+        reused.append(np.where(copied[:, None], matched, scores))
+
+    relevance = evaluation.relevant_files(src_files, hits)
+    for label, scores in (('own scores', own), ('reused scores', reused)):
+        mrr, mean_avgp, *_ = evaluation.block_metrics(
+            relevance, [(0, evaluation.combine_rank_scores(params, *scores))])
+        print(f'Hits with {label}: MRR {np.mean(mrr):.4f}, MAP {np.mean(mean_avgp):.4f}')
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,189 +1,663 @@
+import functools
+import hashlib
+import inspect
 import json
-import operator
 import pickle
+import time
 
 import numpy as np
-from scipy import optimize
+import scipy
+from scipy.optimize import differential_evolution
 
+try:
+    from scipy.optimize._differentialevolution import DifferentialEvolutionSolver
+except ImportError:
+    DifferentialEvolutionSolver = None
+
+import artifacts
+import corpus_store
+import score_store
 from datasets import DATASET, RESULTS_ROOT
+from fusion import FUSIONS
+
+# Fusion of rank scores, where 'de' weights them with parameters
+# estimated by differential evolution, and 'rrf', 'combsum', 'combmnz'
+# and 'priors' need no estimation
+FUSION = 'de'
+
+# Also reporting all fusions side by side with the time they take
+COMPARE_FUSIONS = False
+
+# Ranks cut-offs for Top-N, precision, recall and f-measure
+TOP_N = (1, 5, 10)
+
+# Number of top ranked files kept for each report in the output file
+# (None keeps the complete ranking)
+OUTPUT_TOP_K = 100
+
+# Name of the output files, so runs of different configurations
+# can be kept and compared
+OUTPUT_NAME = 'output'
+
+# Also exporting the output file as JSON lines
+EXPORT_JSONL = False
+
+# Optimizer of the parameters, 'de' for differential evolution or
+# 'coordinate' for exact line searches of one parameter at a time
+OPTIMIZER = 'de'
+
+# Starting the estimation on growing subsets of reports, which are
+# cheaper to rank, before continuing on all reports (see mini_batch.py)
+MINI_BATCH = False
+
+# Starting the estimation from the last estimated population when
+# the scores changed slightly since then, which makes the parameters
+# depend on the last estimation
+WARM_START = False
+
+# Largest change of the cost of the last parameters on the current
+# scores for which the estimation is warm started
+DRIFT_TOLERANCE = 0.05
+
+# Maximum number of generations of a warm started estimation
+WARM_MAXITER = 100
+
+ESTIMATION_FILE = 'estimation.npz'
+
+# Number of generations between checkpoints of the estimation state,
+# which the estimation continues from when resuming
+CHECKPOINT_GENERATIONS = 10
+
+CHECKPOINT_FILE = 'estimation_checkpoint.pickle'
+
+# Attributes of the differential evolution solver which are changed by
+# each generation (the last one only exists in newer versions of scipy)
+_SOLVER_STATE = ('population', 'population_energies', 'random_number_generator',
+                 '_nfev', '_random_population_index')
+
+# Oldest and newest versions of scipy whose private solver state is
+# known to be saved and restored by checkpoints
+_CHECKPOINT_SCIPY = ((1, 10), (1, 17))
+
+# Number of reports ranked together to bound the memory
+_BLOCK_SIZE = 256
+
 
+def combine_rank_scores(coeffs, *rank_scores, dtype=None):
+    """Combining the rank score of different algorithms
+    (in the precision of stored scores by default)
+    """
 
-def combine_rank_scores(coeffs, *rank_scores):
-    """Combining the rank score of different algorithms"""
+    dtype = score_store.DTYPE if dtype is None else dtype
+    coeffs = np.asarray(coeffs, dtype=dtype)
 
-    final_score = []
-    for scores in zip(*rank_scores):
-        combined_score = coeffs @ np.array(scores)
-        final_score.append(combined_score)
+    final_score = coeffs[0] * np.asarray(rank_scores[0], dtype=dtype)
+    for coeff, scores in zip(coeffs[1:], rank_scores[1:]):
+        final_score += coeff * np.asarray(scores, dtype=dtype)
 
     return final_score
 
 
-def cost(coeffs, src_files, bug_reports, *rank_scores):
-    """The cost function to be minimized"""
+def relevant_files(src_files, bug_reports):
+    """Locating the reported fixed files of each bug report
+    in the source files.
+    """
+
+    src_index = {src_id: i for i, src_id in enumerate(src_files)}
+
+    rows = []
+    cols = []
+    n_fixed = []
+    for i, report in enumerate(bug_reports.values()):
+        # Fixed files which are still in the codebase
+        fixed = dict.fromkeys(src_index[fixed] for fixed in report.fixed_files
+                              if fixed in src_index)
+        rows += [i] * len(fixed)
+        cols += fixed
+        n_fixed.append(len(report.fixed_files))
+
+    return (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp),
+            np.array(n_fixed))
+
+
+def rank_matrix(final_scores, rows, cols):
+    """Building a matrix of the sorted ranks of relevant files for each
+    bug report, padded with inf for reports with fewer relevant files.
+    """
+
+    n_reports, n_src = final_scores.shape
+    src_range = np.arange(n_src)
+
+    # Rank of a file is the number of files ranked before it, where ties
+    # keep the order of the source files like a stable sort
+    ranks = np.empty(len(rows))
+    for start in range(0, len(rows), _BLOCK_SIZE):
+        block_rows = rows[start:start + _BLOCK_SIZE]
+        block_cols = cols[start:start + _BLOCK_SIZE]
+
+        scores = final_scores[block_rows]
+        target = scores[np.arange(len(block_rows)), block_cols][:, None]
+        ranks[start:start + _BLOCK_SIZE] = (
+            (scores > target).sum(axis=1)
+            + ((scores == target) & (src_range < block_cols[:, None])).sum(axis=1)
+            + 1
+        )
 
-    final_scores = combine_rank_scores(coeffs, *rank_scores)
+    counts = np.bincount(rows, minlength=n_reports)
+    matrix = np.full((n_reports, max(counts.max(initial=0), 1)), np.inf)
 
-    mrr = []
-    mean_avgp = []
+    # Sorting ranks within each report and placing them in their row
+    order = np.lexsort((ranks, rows))
+    offsets = np.cumsum(counts) - counts
+    positions = np.arange(len(rows)) - offsets[rows[order]]
+    matrix[rows[order], positions] = ranks[order]
 
-    for i, report in enumerate(bug_reports.items()):
+    return matrix
 
-        # Finding source files from the simis indices
-        src_ranks, _ = zip(*sorted(zip(src_files.keys(), final_scores[i]),
-                                   key=operator.itemgetter(1), reverse=True))
 
-        # Getting reported fixed files
-        fixed_files = report[1].fixed_files
+def report_metrics(ranks, n_fixed, n_src, top_n=TOP_N):
+    """Per bug report reciprocal rank, average precision, and hits,
+    precision, recall and f-measure at each N.
+    """
 
-        # Getting the ranks of reported fixed files
-        relevant_ranks = sorted(src_ranks.index(fixed) + 1
-                                for fixed in fixed_files if fixed in src_ranks)
+    found = np.isfinite(ranks)
 
-        # If required fixed files are not in the codebase anymore
-        if not relevant_ranks:
-            mrr.append(0)
-            mean_avgp.append(0)
-            continue
+    # Reciprocal rank of the first relevant file
+    recip_rank = np.where(found[:, 0], 1 / ranks[:, 0], 0)
+
+    # Average precision over the relevant files
+    positions = np.arange(1, ranks.shape[1] + 1)
+    avg_prec = (np.where(found, positions / ranks, 0).sum(axis=1)
+                / np.maximum(found.sum(axis=1), 1))
+
+    top_n = np.asarray(top_n)
+    hits = (ranks[:, :, None] <= top_n).sum(axis=1)
+
+    precision = hits / np.minimum(top_n, n_src)
+    recall = hits / np.maximum(n_fixed, 1)[:, None]
+    sum_pr = precision + recall
+    f_measure = np.divide(2 * precision * recall, sum_pr,
+                          out=np.zeros_like(sum_pr), where=sum_pr > 0)
+
+    return recip_rank, avg_prec, hits, precision, recall, f_measure
+
+
+def score_blocks(rank_scores, block_size=None):
+    """Blocks of report rows (score_store.CHUNK_SIZE by default) of all
+    rank scores in lockstep, which are read from the score store if scorer
+    names or row ranges are given.
+    """
+
+    block_size = score_store.CHUNK_SIZE if block_size is None else block_size
+
+    if isinstance(rank_scores[0], (str, score_store.RowRange)):
+        yield from score_store.iter_blocks(rank_scores, block_size)
+        return
+
+    for start in range(0, len(rank_scores[0]), block_size):
+        yield start, [scores[start:start + block_size] for scores in rank_scores]
+
+
+def final_blocks(coeffs, rank_scores):
+    """Blocks of combined scores of report rows"""
+
+    for start, scores in score_blocks(rank_scores):
+        yield start, combine_rank_scores(coeffs, *scores)
+
+
+def fused_blocks(name, rank_scores):
+    """Blocks of report rows fused without estimated parameters"""
+
+    for start, scores in score_blocks(rank_scores):
+        yield start, FUSIONS[name](scores)
 
-        # MRR
-        min_rank = relevant_ranks[0]
-        mrr.append(1 / min_rank)
 
-        # MAP
-        mean_avgp.append(np.mean([len(relevant_ranks[:j + 1]) / rank
-                                  for j, rank in enumerate(relevant_ranks)]))
+def slice_relevance(relevance, start, stop):
+    """Relevant files of a range of reports, with rows counted from its start"""
+
+    rows, cols, n_fixed = relevance
+
+    # Relevant files are sorted by their report
+    lo, hi = np.searchsorted(rows, [start, stop])
+
+    return rows[lo:hi] - start, cols[lo:hi], n_fixed[start:stop]
+
+
+def block_metrics(relevance, blocks):
+    """Per report metrics, computed block by block"""
+
+    metrics = []
+    for start, final_scores in blocks:
+        rows, cols, n_fixed = slice_relevance(relevance, start, start + len(final_scores))
+        ranks = rank_matrix(final_scores, rows, cols)
+        metrics.append(report_metrics(ranks, n_fixed, final_scores.shape[1]))
+
+    return [np.concatenate(metric) for metric in zip(*metrics)]
+
+
+def cost(coeffs, relevance, *rank_scores):
+    """The cost function to be minimized"""
+
+    mrr, mean_avgp, *_ = block_metrics(relevance, final_blocks(coeffs, rank_scores))
 
     return -1 * (np.mean(mrr) + np.mean(mean_avgp))
 
 
-def estiamte_params(src_files, bug_reports, *rank_scores):
-    """Estimating linear combination parameters"""
+def _as_rank_scores(rank_scores):
+    """Score matrices as arrays, leaving the scorer names and row ranges
+    to be streamed
+    """
+
+    return [scores if isinstance(scores, (str, score_store.RowRange)) else np.asarray(scores)
+            for scores in rank_scores]
+
+
+def score_fingerprint(relevance, rank_scores):
+    """Hash of the relevant files and scores the parameters are estimated on"""
+
+    fingerprint = hashlib.sha1()
+    for array in relevance:
+        fingerprint.update(np.ascontiguousarray(array))
+    for _, scores in score_blocks(rank_scores):
+        for block in scores:
+            fingerprint.update(np.ascontiguousarray(block))
+
+    return fingerprint.hexdigest()
+
+
+def load_estimation(n_params, optimizer):
+    """The last estimated parameters (and population of differential
+    evolution), if they are estimated by the optimizer for the same
+    number of scores.
+    """
+
+    path = DATASET.root / ESTIMATION_FILE
+    if not path.exists():
+        return None
+
+    with np.load(path) as estimation:
+        estimation = {key: estimation[key] for key in estimation.files}
+
+    # Estimations saved without their optimizer are from differential evolution
+    if (estimation['params'].shape != (n_params,)
+            or str(estimation.get('optimizer', 'de')) != optimizer):
+        return None
+
+    return estimation
+
+
+def final_population(res, seed=458711526):
+    """Final population of the estimation, which older versions of scipy
+    don't return, so it's sampled around the estimated parameters.
+    """
+
+    population = getattr(res, 'population', None)
+    if population is not None:
+        return population
+
+    rng = np.random.default_rng(seed)
+    population = res.x + rng.normal(0, 0.05, (15 * len(res.x), len(res.x)))
+    population[0] = res.x
+
+    return np.clip(population, 0, 1)
+
+
+def _save_checkpoint(solver, nit, fingerprint):
+    """Saving the population and random state of the estimation"""
+
+    state = {name: getattr(solver, name) for name in _SOLVER_STATE if hasattr(solver, name)}
+
+    path = DATASET.root / CHECKPOINT_FILE
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as file:
+        pickle.dump({'fingerprint': fingerprint, 'nit': nit, 'state': state},
+                    file, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+
+
+def _load_checkpoint(fingerprint):
+    """The checkpoint of an interrupted estimation on the same scores"""
+
+    path = DATASET.root / CHECKPOINT_FILE
+    if not path.exists():
+        return None
+
+    with open(path, 'rb') as file:
+        checkpoint = pickle.load(file)
+
+    return checkpoint if checkpoint['fingerprint'] == fingerprint else None
 
-    res = optimize.differential_evolution(
+
+def checkpoints_supported():
+    """Whether checkpoints know the private solver state of the
+    installed scipy
+    """
+
+    version = tuple(int(part) for part in scipy.__version__.split('.')[:2])
+
+    return (DifferentialEvolutionSolver is not None
+            and _CHECKPOINT_SCIPY[0] <= version <= _CHECKPOINT_SCIPY[1])
+
+
+def fit_params(relevance, rank_scores, fingerprint=None, **options):
+    """Searching the parameters with differential evolution, where the
+    state is saved every few generations if the fingerprint of scores is
+    given, so an interrupted search can be resumed with the same result.
+    """
+
+    options = {'polish': True, **options}
+    random_state = np.random.RandomState(458711526)
+
+    if not checkpoints_supported():
+        if fingerprint is not None:
+            print(f'Checkpoints are not supported with scipy {scipy.__version__}, '
+                  f'the estimation runs without them')
+
+        # The function takes the same random state as the solver as seed
+        # while it still has it
+        seed_arg = ('seed' if 'seed' in inspect.signature(differential_evolution).parameters
+                    else 'rng')
+        return differential_evolution(cost, bounds=[(0, 1)] * len(rank_scores),
+                                      args=(relevance, *rank_scores),
+                                      strategy='randtobest1exp',
+                                      **{seed_arg: random_state, **options})
+
+    # Newer versions of scipy take the random state as rng
+    seed_arg = ('rng' if 'rng' in inspect.signature(DifferentialEvolutionSolver).parameters
+                else 'seed')
+
+    nit = 0
+
+    def checkpoint(xk, convergence):
+        nonlocal nit
+        nit += 1
+        if nit % CHECKPOINT_GENERATIONS == 0:
+            _save_checkpoint(solver, nit, fingerprint)
+
+    with DifferentialEvolutionSolver(
         cost, bounds=[(0, 1)] * len(rank_scores),
-        args=(src_files, bug_reports, *rank_scores),
-        strategy='randtobest1exp', polish=True, seed=458711526
-    )
+        args=(relevance, *rank_scores),
+        strategy='randtobest1exp',
+        callback=None if fingerprint is None else checkpoint,
+        **{seed_arg: random_state, **options}
+    ) as solver:
 
-    return res.x.tolist()
+        last = (_load_checkpoint(fingerprint)
+                if fingerprint is not None and score_store.RESUME else None)
+        if last is not None:
+            nit = last['nit']
+            for name, value in last['state'].items():
+                setattr(solver, name, value)
+            solver.maxiter -= nit
 
+        res = solver.solve()
 
-def evaluate(src_files, bug_reports, coeffs, *rank_scores):
+    # Generations before the checkpoint count in a resumed search, and
+    # its evaluations are counted by the restored solver
+    if last is not None:
+        res.nit += last['nit']
 
-    final_scores = combine_rank_scores(coeffs, *rank_scores)
+    if fingerprint is not None:
+        (DATASET.root / CHECKPOINT_FILE).unlink(missing_ok=True)
 
-    # Writer for the output file
-    result_file = open(RESULTS_ROOT / f'{DATASET.name}_output.jsonl', 'w')
+    return res
 
-    top_n = (1, 5, 10)
-    top_n_rank = [0] * len(top_n)
-    mrr = []
-    mean_avgp = []
 
-    precision_at_n = [[] for _ in top_n]
-    recall_at_n = [[] for _ in top_n]
-    f_measure_at_n = [[] for _ in top_n]
+def search_params(relevance, rank_scores, fingerprint=None, x0=None, **options):
+    """Searching the parameters with the configured optimizer, where
+    differential evolution which isn't started from a population starts
+    from the one evolved on subsets of reports if MINI_BATCH is set.
+    """
 
-    for i, (bug_id, report) in enumerate(bug_reports.items()):
+    if OPTIMIZER == 'coordinate':
+        import coordinate_ascent
 
-        # Finding source codes from the simis indices
-        src_ranks, _ = zip(*sorted(zip(src_files.keys(), final_scores[i]),
-                                   key=operator.itemgetter(1), reverse=True))
+        return coordinate_ascent.fit_params(relevance, rank_scores, x0)
 
-        # Getting reported fixed files
-        fixed_files = report.fixed_files
+    start_cost = None
+    if MINI_BATCH and not options:
+        import mini_batch
 
-        # Iterating over top n
-        for k, rank in enumerate(top_n):
-            hit = set(src_ranks[:rank]) & set(fixed_files)
+        population = mini_batch.initial_population(relevance, rank_scores)
+        start_cost = cost(population[0], relevance, *rank_scores)
+        options = mini_batch.final_options(population)
 
-            # Computing top n rank
-            if hit:
-                top_n_rank[k] += 1
+    res = fit_params(relevance, rank_scores, fingerprint, **options)
 
-            # Computing precision and recall at n
-            if not hit:
-                precision_at_n[k].append(0)
-            else:
-                precision_at_n[k].append(len(hit) / len(src_ranks[:rank]))
-            recall_at_n[k].append(len(hit) / len(fixed_files))
-            if not (precision_at_n[k][i] + recall_at_n[k][i]):
-                f_measure_at_n[k].append(0)
+    if start_cost is not None:
+        mini_batch.check_tolerance(start_cost, res)
+
+    return res
+
+
+def estiamte_params(src_files, bug_reports, *rank_scores):
+    """Estimating linear combination parameters, starting from the last
+    estimation if the scores didn't drift much since then.
+    """
+
+    rank_scores = _as_rank_scores(rank_scores)
+    relevance = relevant_files(src_files, bug_reports)
+    fingerprint = score_fingerprint(relevance, rank_scores)
+
+    options, x0 = {}, None
+    last = load_estimation(len(rank_scores), OPTIMIZER) if WARM_START else None
+    if last is not None:
+        if str(last['fingerprint']) == fingerprint:
+            print('Reusing the parameters estimated on the same scores')
+            return last['params'].tolist()
+
+        drift = abs(cost(last['params'], relevance, *rank_scores) - float(last['cost']))
+        if drift <= DRIFT_TOLERANCE:
+            print(f'Warm starting from the last estimation (cost drift {drift:.4f})')
+            if OPTIMIZER == 'coordinate':
+                x0 = last['params']
             else:
-                f_measure_at_n[k].append(2 * (precision_at_n[k][i] * recall_at_n[k][i])
-                                         / (precision_at_n[k][i] + recall_at_n[k][i]))
+                options = {'init': last['population'], 'maxiter': WARM_MAXITER}
+        else:
+            print(f'Estimating from scratch, the cost drifted by {drift:.4f} '
+                  f'since the last estimation')
 
-        # Getting the ranks of reported fixed files
-        relevant_ranks = sorted(src_ranks.index(fixed) + 1
-                                for fixed in fixed_files if fixed in src_ranks)
+    res = search_params(relevance, rank_scores, fingerprint, x0, **options)
 
-        # If required fixed files are not in the codebase anymore
-        if not relevant_ranks:
-            mrr.append(0)
-            mean_avgp.append(0)
-            continue
+    # Coordinate ascent has no population to start differential evolution from
+    population = {'population': final_population(res)} if OPTIMIZER == 'de' else {}
+    np.savez(DATASET.root / ESTIMATION_FILE, params=res.x, cost=res.fun,
+             fingerprint=fingerprint, optimizer=OPTIMIZER, **population)
 
-        # MRR
-        min_rank = relevant_ranks[0]
-        mrr.append(1 / min_rank)
+    return res.x.tolist()
 
-        # MAP
-        mean_avgp.append(np.mean([len(relevant_ranks[:j + 1]) / rank
-                                  for j, rank in enumerate(relevant_ranks)]))
 
-        result_file.write(json.dumps(
-            {'bug_id': bug_id, 'src_ranks': src_ranks}) + '\n'
-        )
+def write_ranks(bug_ids, src_keys, blocks, top_k=OUTPUT_TOP_K, name='output'):
+    """Saving the top k ranked source files of each bug report"""
+
+    top_k = len(src_keys) if top_k is None else min(top_k, len(src_keys))
+
+    top_ranks = np.empty((len(bug_ids), top_k), dtype=np.int32)
+    top_scores = np.empty((len(bug_ids), top_k), dtype=np.float32)
+    for start, final_scores in blocks:
+        for i in range(0, len(final_scores), _BLOCK_SIZE):
+            block = final_scores[i:i + _BLOCK_SIZE]
+            order = np.argsort(-block, axis=1, kind='stable')[:, :top_k]
+            top_ranks[start + i:start + i + len(block)] = order
+            top_scores[start + i:start + i + len(block)] = np.take_along_axis(
+                block, order, axis=1)
+
+    np.savez_compressed(RESULTS_ROOT / f'{DATASET.name}_{name}.npz',
+                        bug_ids=np.array(bug_ids), src_keys=np.array(src_keys),
+                        ranks=top_ranks, scores=top_scores)
+
+
+def export_jsonl(name='output'):
+    """Streaming the saved ranks into a JSON lines file"""
+
+    output = np.load(RESULTS_ROOT / f'{DATASET.name}_{name}.npz')
+    src_keys = output['src_keys'].tolist()
+
+    with open(RESULTS_ROOT / f'{DATASET.name}_{name}.jsonl', 'w') as file:
+        for bug_id, ranks in zip(output['bug_ids'].tolist(), output['ranks']):
+            file.write(json.dumps(
+                {'bug_id': bug_id, 'src_ranks': [src_keys[j] for j in ranks]}) + '\n'
+            )
+
+
+def save_report_metrics(name, bug_ids, recip_rank, avg_prec, hits):
+    """Saving per report metrics for significance tests, with the ids
+    of the reports to pair them with the metrics of other runs
+    """
+
+    np.savez(RESULTS_ROOT / f'{DATASET.name}_{name}_metrics.npz', bug_ids=np.array(bug_ids),
+             recip_rank=recip_rank, avg_prec=avg_prec, hits=hits)
+
+
+def load_report_metrics(name):
+    """Report ids (None if they weren't saved) and per report metrics"""
+
+    with np.load(RESULTS_ROOT / f'{DATASET.name}_{name}_metrics.npz') as metrics:
+        bug_ids = metrics['bug_ids'].tolist() if 'bug_ids' in metrics else None
+        return bug_ids, metrics['recip_rank'], metrics['avg_prec'], metrics['hits']
+
+
+def evaluate_blocks(src_files, bug_reports, make_blocks, name='output'):
+    """Evaluating and saving the ranks and per report metrics of final
+    score blocks, where make_blocks starts a new pass over them.
+    """
 
-    result_file.close()
+    mrr, mean_avgp, hits, precision_at_n, recall_at_n, f_measure_at_n = block_metrics(
+        relevant_files(src_files, bug_reports), make_blocks())
+
+    write_ranks(list(bug_reports), list(src_files), make_blocks(), name=name)
+    save_report_metrics(name, list(bug_reports), mrr, mean_avgp, hits)
+
+    top_n_rank = (hits > 0).sum(axis=0).tolist()
 
     return (top_n_rank, [x / len(bug_reports) for x in top_n_rank],
             np.mean(mrr), np.mean(mean_avgp),
-            np.mean(precision_at_n, axis=1).tolist(), np.mean(
-                recall_at_n, axis=1).tolist(),
-            np.mean(f_measure_at_n, axis=1).tolist())
+            np.mean(precision_at_n, axis=0).tolist(), np.mean(
+                recall_at_n, axis=0).tolist(),
+            np.mean(f_measure_at_n, axis=0).tolist())
+
+
+def evaluate(src_files, bug_reports, coeffs, *rank_scores):
+
+    rank_scores = _as_rank_scores(rank_scores)
+
+    return evaluate_blocks(src_files, bug_reports,
+                           functools.partial(final_blocks, coeffs, rank_scores))
+
+
+def compare_fusions(src_files, bug_reports, timings, *rank_scores):
+    """Reporting the results of the DE weighting and all fusions side by
+    side, including the time of estimating parameters and ranking. The
+    given timings of already evaluated ones are reused.
+    """
+
+    rank_scores = _as_rank_scores(rank_scores)
+    relevance = relevant_files(src_files, bug_reports)
+
+    for name in ['de', *FUSIONS]:
+        if name in timings:
+            continue
+
+        start = time.perf_counter()
+        if name == 'de':
+            params = estiamte_params(src_files, bug_reports, *rank_scores)
+            blocks = final_blocks(params, rank_scores)
+        else:
+            blocks = fused_blocks(name, rank_scores)
+        mrr, mean_avgp, hits, *_ = block_metrics(relevance, blocks)
+
+        timings[name] = (time.perf_counter() - start,
+                         ((hits > 0).mean(axis=0).tolist(), np.mean(mrr), np.mean(mean_avgp)))
+
+    for name, (elapsed, (top_n_percent, mrr, mean_avgp)) in timings.items():
+        print(f'{name}: {elapsed:.2f}s, MRR {mrr:.4f}, MAP {mean_avgp:.4f}, '
+              f'Top N Rank % {[round(x, 4) for x in top_n_percent]}')
+
+
+def verify_precision(src_files, bug_reports, coeffs, *rank_scores):
+    """Reporting the rank changes of relevant files when scores are
+    combined in the configured precision instead of float64, which
+    needs the scores to be stored in float64.
+    """
+
+    rank_scores = _as_rank_scores(rank_scores)
+    relevance = relevant_files(src_files, bug_reports)
+
+    n_changed = 0
+    metrics = {'float64': [], score_store.DTYPE: []}
+    for start, scores in score_blocks(rank_scores):
+        rows, cols, n_fixed = slice_relevance(relevance, start, start + len(scores[0]))
+
+        block_ranks = []
+        for dtype in metrics:
+            final_scores = combine_rank_scores(coeffs, *scores, dtype=dtype)
+            ranks = rank_matrix(final_scores, rows, cols)
+            metrics[dtype].append(report_metrics(ranks, n_fixed, final_scores.shape[1]))
+            block_ranks.append(ranks)
+
+        exact_ranks, ranks = block_ranks[0], block_ranks[-1]
+        n_changed += (exact_ranks != ranks).any(axis=1).sum()
+
+    print(f'Reports with changed ranks in {score_store.DTYPE}: '
+          f'{n_changed} of {len(bug_reports)}')
+    for dtype, blocks in metrics.items():
+        mrr, mean_avgp, *_ = [np.concatenate(metric) for metric in zip(*blocks)]
+        print(f'{dtype}: MRR {np.mean(mrr):.6f}, MAP {np.mean(mean_avgp):.6f}')
+
+
+def load_rank_scores(*names):
+    """Loading the scores of scorers, or keeping only their names in
+    streaming mode to read them chunk by chunk.
+    """
+
+    if score_store.STREAMING:
+        return names
+
+    return [score_store.load_scores(name) for name in names]
 
 
 def main():
-    with open(DATASET.root / 'preprocessed_src.pickle', 'rb') as file:
-        src_files = pickle.load(file)
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'rb') as file:
-        bug_reports = pickle.load(file)
-
-    with open(DATASET.root / 'token_matching.json', 'r') as file:
-        token_matching_score = json.load(file)
-    with open(DATASET.root / 'vsm_similarity.json', 'r') as file:
-        vsm_similarity_score = json.load(file)
-    with open(DATASET.root / 'stack_trace.json', 'r') as file:
-        stack_trace_score = json.load(file)
-    with open(DATASET.root / 'semantic_similarity.json', 'r') as file:
-        semantic_similarity_score = json.load(file)
-    with open(DATASET.root / 'fixed_bug_reports.json', 'r') as file:
-        fixed_bug_reports_score = json.load(file)
-
-    params = estiamte_params(
-        src_files,
-        bug_reports,
-        vsm_similarity_score,
-        token_matching_score,
-        fixed_bug_reports_score,
-        semantic_similarity_score,
-        stack_trace_score,
-    )
-
-    results = evaluate(
-        src_files,
-        bug_reports,
-        params,
-        vsm_similarity_score,
-        token_matching_score,
-        fixed_bug_reports_score,
-        semantic_similarity_score,
-        stack_trace_score,
-    )
-
-    print(f'{params = }')
+    # Only the ids of source files are needed
+    src_files = corpus_store.load_src([])
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    (vsm_similarity_score, token_matching_score, fixed_bug_reports_score,
+     semantic_similarity_score, stack_trace_score) = load_rank_scores(
+        'vsm_similarity', 'token_matching', 'fixed_bug_reports',
+        'semantic_similarity', 'stack_trace')
+
+    rank_scores = _as_rank_scores((vsm_similarity_score, token_matching_score,
+                                   fixed_bug_reports_score, semantic_similarity_score,
+                                   stack_trace_score))
+
+    start = time.perf_counter()
+    if FUSION == 'de':
+        params = estiamte_params(src_files, bug_reports, *rank_scores)
+
+        # Saving the parameters for ranking new reports
+        with open(DATASET.root / 'params.json', 'w') as file:
+            json.dump(params, file)
+
+        make_blocks = functools.partial(final_blocks, params, rank_scores)
+    else:
+        params = None
+        make_blocks = functools.partial(fused_blocks, FUSION, rank_scores)
+
+    results = evaluate_blocks(src_files, bug_reports, make_blocks, OUTPUT_NAME)
+    elapsed = time.perf_counter() - start
+
+    if EXPORT_JSONL:
+        export_jsonl(OUTPUT_NAME)
+
+    if score_store.VERIFY_PRECISION and FUSION == 'de':
+        verify_precision(src_files, bug_reports, params, *rank_scores)
+
+    if COMPARE_FUSIONS:
+        compare_fusions(src_files, bug_reports,
+                        {FUSION: (elapsed, (results[1], results[2], results[3]))},
+                        *rank_scores)
+
+    print(f'{params = }' if FUSION == 'de' else f'{FUSION = }')
     print('Top N Rank:', results[0])
     print('Top N Rank %:', results[1])
     print('MRR:', results[2])
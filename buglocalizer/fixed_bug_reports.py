@@ -1,16 +1,34 @@
-import json
+import itertools
 import pickle
+from collections import OrderedDict
 
 import numpy as np
+from scipy import sparse
+from scipy.special import expit
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.multiclass import OneVsRestClassifier
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import FeatureUnion, Pipeline
-from sklearn.preprocessing import MinMaxScaler, MultiLabelBinarizer
+from sklearn.preprocessing import MultiLabelBinarizer, normalize
 
+import artifacts
+import cascade
+import corpus_store
+import score_store
 from datasets import DATASET
 
+# Number of hashed features of each text field of reports
+# in the incremental model of appended and replayed reports
+N_FEATURES = 2 ** 18
+
+# Number of counts of newly learned reports which are kept apart from
+# the count matrix before they're merged into it
+MERGE_SIZE = 2 ** 14
+
+_hasher = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None,
+                            lowercase=False)
+
 
 class FeatureSelector(BaseEstimator, TransformerMixin):
     """Selecting appropriate feature set in the pipeline"""
@@ -36,7 +54,11 @@ def multilabel_clf(train_set, test_set, src_keys):
     if len(train_set) <= 1:
         return [0] * len(src_keys)
 
-    train_fixed = [r.fixed_files for r in train_set]
+    # Only the given source files are learned as classes
+    src_set = set(src_keys)
+    train_fixed = [[f for f in r.fixed_files if f in src_set] for r in train_set]
+    if not any(train_fixed):
+        return [0] * len(src_keys)
 
     # Classes need to be binarized for the classifier
     mlb = MultiLabelBinarizer()
@@ -62,46 +84,261 @@ def multilabel_clf(train_set, test_set, src_keys):
     # Getting probabilities for all source files
     probas = classifier.predict_proba(test_set)
 
-    labeled_proba = dict(zip(mlb.classes_, probas[0]))
+    # With a single class, the classifier also returns the negative probability
+    labeled_proba = dict(zip(mlb.classes_, probas[0][-len(mlb.classes_):]))
     src_probas = [labeled_proba.get(src_name, 0) for src_name in src_keys]
 
     return src_probas
 
 
-def prepare_clf(bug_reports):
-    """Preparing train set and test set based on previously fixed bugs"""
+def report_features(reports):
+    """Sublinear term frequencies of the summary and of the pos-tagged
+    summary and description of reports, each scaled to unit length
+    """
+
+    if not reports:
+        return sparse.csr_matrix((0, 2 * N_FEATURES))
+
+    blocks = []
+    for key in ('summary', 'postagged'):
+        counts = _hasher.transform(FeatureSelector(key).transform(reports))
+        counts.data = 1 + np.log(counts.data)
+        blocks.append(normalize(counts))
+
+    return sparse.hstack(blocks, format='csr')
+
+
+class FixedBugModel:
+    """Multinomial naive Bayes of each source file against the other files
+    (one-vs-rest), learned from the term counts of the reports which fixed
+    it. Counts of new reports are added to the learned ones, so learning a
+    report doesn't depend on the number of earlier reports. It scores the
+    appended and replayed reports, without refitting the tf-idf classifier
+    of the full run for each of them.
+    """
+
+    MODEL_FILE = 'fixed_bug_model.pickle'
+
+    __slots__ = ['src_keys', 'positions', 'bug_ids', 'n_fixed', 'totals', 'class_totals',
+                 'n_seen', 'counts', 'pending', 'n_pending']
+
+    def __init__(self, src_keys):
+        self.src_keys = list(src_keys)
+        self.positions = {src_id: i for i, src_id in enumerate(self.src_keys)}
+        self.bug_ids = []
+
+        # Number of reports fixing each file, and the feature counts of
+        # all reports and their sums over the reports of each file
+        self.n_fixed = np.zeros(len(self.src_keys))
+        self.totals = np.zeros(2 * N_FEATURES)
+        self.class_totals = np.zeros(len(self.src_keys))
+        self.n_seen = 0
+
+        # Feature counts of the reports of each file, with the counts
+        # of new reports waiting to be merged
+        self.counts = sparse.csr_matrix((2 * N_FEATURES, len(self.src_keys)))
+        self.pending = []
+        self.n_pending = 0
+
+    def update(self, bug_reports, features=None):
+        """Learning the fixed files of reports, with their features if
+        they're already computed
+        """
+
+        if not bug_reports:
+            return
+
+        if features is None:
+            features = report_features(list(bug_reports.values()))
+        for (bug_id, report), x in zip(bug_reports.items(), features):
+            classes = np.unique([self.positions[src_id] for src_id in report.fixed_files
+                                 if src_id in self.positions]).astype(np.intp)
+
+            self.bug_ids.append(bug_id)
+            self.n_seen += np.count_nonzero(self.totals[x.indices] == 0)
+            self.totals[x.indices] += x.data
+            self.n_fixed[classes] += 1
+            self.class_totals[classes] += x.data.sum()
+            self.pending.append((np.repeat(x.indices, len(classes)),
+                                 np.tile(classes, len(x.indices)),
+                                 np.repeat(x.data, len(classes))))
+            self.n_pending += len(x.indices) * len(classes)
+
+        if len(self.pending) > 1:
+            self.pending = [tuple(map(np.concatenate, zip(*self.pending)))]
+
+        if self.n_pending >= MERGE_SIZE:
+            rows, cols, counts = self.pending[0]
+            self.counts = self.counts + sparse.csr_matrix((counts, (rows, cols)),
+                                                          shape=self.counts.shape)
+            self.pending = []
+            self.n_pending = 0
+
+    def _pending_counts(self, features):
+        """Counts of the sorted features in the reports which aren't merged"""
+
+        shape = (len(features), self.counts.shape[1])
+        if not self.pending or not len(features):
+            return sparse.csr_matrix(shape)
+
+        rows, cols, counts = self.pending[0]
+        positions = np.minimum(np.searchsorted(features, rows), len(features) - 1)
+        kept = features[positions] == rows
+
+        return sparse.csr_matrix((counts[kept], (positions[kept], cols[kept])), shape=shape)
+
+    def probabilities(self, x):
+        """Probability of each source file being fixed by a report,
+        given by its features
+        """
+
+        n_reports = len(self.bug_ids)
+        if n_reports <= 1:
+            return np.zeros(len(self.src_keys))
+
+        # Terms which no learned report has are left out, like the
+        # ones out of the vocabulary of a fitted vectorizer
+        order = np.argsort(x.indices)
+        seen = self.totals[x.indices[order]] > 0
+        features, weights = x.indices[order][seen], x.data[order][seen]
+        length = weights.sum()
+
+        class_counts = (self.counts[features] + self._pending_counts(features)).tocoo()
+        feature_totals = self.totals[features]
+        row_weights = weights[class_counts.row]
+        row_totals = feature_totals[class_counts.row]
+
+        # Log likelihoods of the report under the reports fixing each
+        # file and under the other reports, with add-one smoothing
+        positive = np.bincount(class_counts.col, row_weights * np.log1p(class_counts.data),
+                               minlength=len(self.src_keys))
+        negative = weights @ np.log1p(feature_totals) + np.bincount(
+            class_counts.col,
+            row_weights * (np.log1p(row_totals - class_counts.data) - np.log1p(row_totals)),
+            minlength=len(self.src_keys))
+
+        n_terms = max(self.n_seen, 1)
+        with np.errstate(divide='ignore'):
+            positive += np.log(self.n_fixed) - length * np.log(self.class_totals + n_terms)
+            negative += (np.log(n_reports - self.n_fixed)
+                         - length * np.log(self.totals.sum() - self.class_totals + n_terms))
+
+        return expit(positive - negative)
+
+    def save(self):
+        with open(DATASET.root / self.MODEL_FILE, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, src_keys, bug_reports):
+        """Loading the saved model, learning the given reports which it
+        hasn't learned yet, or all of them if it learned other reports.
+        """
+
+        model_path = DATASET.root / cls.MODEL_FILE
+        bug_ids = list(bug_reports)
+
+        if model_path.exists():
+            with open(model_path, 'rb') as file:
+                model = pickle.load(file)
+            if (model.src_keys == list(src_keys)
+                    and model.bug_ids == bug_ids[:len(model.bug_ids)]):
+                model.update(OrderedDict(
+                    (bug_id, bug_reports[bug_id]) for bug_id in bug_ids[len(model.bug_ids):]))
+                return model
+
+        model = cls(src_keys)
+        model.update(bug_reports)
+
+        return model
+
+
+def iter_clf(bug_reports, shortlist=None, history=None, start=0, skipped=()):
+    """Preparing train set and test set based on previously fixed bugs
+    (including the history reports before the given ones), yielding the
+    probabilities of reports one by one from the start report. The skipped
+    reports are only learned.
+    """
+
+    # Only the ids of source files are needed
+    src_files = corpus_store.load_src([])
+
+    src_keys = np.array(list(src_files.keys()))
+    history = [] if history is None else list(history.values())
+    reports = list(bug_reports.items())
+    learned = history + [report for _, report in reports]
+
+    for i, (bug_id, report) in enumerate(reports[start:], start):
+        if bug_id in skipped:
+            continue
+
+        # In a cascade only the candidates are classified,
+        # and the rest of the files get zero
+        candidates = slice(None) if shortlist is None else shortlist[i]
+        probas = multilabel_clf(learned[:len(history) + i], [report],
+                                src_keys[candidates].tolist())
 
-    with open(DATASET.root / 'preprocessed_src.pickle', 'rb') as file:
-        src_files = pickle.load(file)
+        normalized_probas = np.zeros(len(src_keys))
+        normalized_probas[candidates] = score_store.min_max_rows(probas)
 
-    bug_reports = list(bug_reports.values())
+        yield normalized_probas
 
-    min_max_scaler = MinMaxScaler()
 
-    probabilities = []
-    for i, report in enumerate(bug_reports):
-        probas = multilabel_clf(bug_reports[:i], [report], src_files.keys())
+def iter_model_clf(bug_reports, shortlist=None, history=None, model=None, save_model=False,
+                   skipped=()):
+    """Probabilities of reports one by one from the incremental model,
+    which learns each report after scoring it. A given model which learned
+    the history goes on learning the reports, and the skipped reports are
+    only learned.
+    """
 
-        probas = np.array([float(count)
-                           for count in probas]).reshape(-1, 1)
-        normalized_probas = np.concatenate(
-            min_max_scaler.fit_transform(probas)
-        )
+    # Only the ids of source files are needed
+    src_files = corpus_store.load_src([])
 
-        probabilities.append(normalized_probas.tolist())
+    if model is None:
+        model = FixedBugModel.load(list(src_files),
+                                   OrderedDict() if history is None else history)
 
-    return probabilities
+    reports = list(bug_reports.items())
+    features = report_features([report for _, report in reports])
+    for i, (bug_id, report), x in zip(itertools.count(), reports, features):
+        if bug_id in skipped:
+            model.update(OrderedDict([(bug_id, report)]), x)
+            continue
+
+        candidates = slice(None) if shortlist is None else shortlist[i]
+        probas = model.probabilities(x)[candidates]
+
+        normalized_probas = np.zeros(len(src_files))
+        normalized_probas[candidates] = score_store.min_max_rows(probas)
+
+        yield normalized_probas
+
+        model.update(OrderedDict([(bug_id, report)]), x)
+
+    if save_model:
+        model.save()
+
+
+def prepare_clf(bug_reports, shortlist=None, history=None, skipped=()):
+    return list(iter_clf(bug_reports, shortlist, history, skipped=skipped))
 
 
 def main():
 
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'rb') as file:
-        bug_reports = pickle.load(file)
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    shortlist = cascade.load_shortlist() if cascade.USE_CASCADE else None
 
-    probabilities = prepare_clf(bug_reports)
+    # Continuing after the saved rows of an interrupted run when resuming
+    # on the same source files, reports and config
+    fingerprint = score_store.stage_fingerprint(
+        list(corpus_store.load_src([])), list(bug_reports), shortlist)
+    start = score_store.resume_row('fixed_bug_reports', fingerprint)
+    probabilities = iter_clf(bug_reports, shortlist, start=start)
 
-    with open(DATASET.root / 'fixed_bug_reports.json', 'w') as file:
-        json.dump(probabilities, file)
+    score_store.save_scores('fixed_bug_reports', probabilities, first_row=start,
+                            fingerprint=fingerprint)
 
 
 if __name__ == '__main__':
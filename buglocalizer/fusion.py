@@ -0,0 +1,57 @@
+import numpy as np
+
+# Constant of reciprocal rank fusion damping the weight of top ranks
+RRF_K = 60
+
+# Weights of the fixed prior fusion in the order of rank scores
+# (vsm, token matching, fixed bug reports, semantic, stack trace)
+FIXED_PRIORS = (0.4, 0.2, 0.1, 0.1, 0.2)
+
+
+def row_ranks(scores):
+    """Rank of each source file in the rows of a block of scores,
+    where tied files share their best rank.
+    """
+
+    scores = np.asarray(scores)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    sorted_scores = np.take_along_axis(scores, order, axis=1)
+
+    # Position of the first file of each run of tied scores
+    positions = np.arange(scores.shape[1])
+    new_run = np.ones(scores.shape, dtype=bool)
+    new_run[:, 1:] = sorted_scores[:, 1:] != sorted_scores[:, :-1]
+    run_starts = np.maximum.accumulate(np.where(new_run, positions, 0), axis=1)
+
+    ranks = np.empty(scores.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, run_starts + 1, axis=1)
+
+    return ranks
+
+
+def reciprocal_rank_fusion(scores):
+    return sum(1 / (RRF_K + row_ranks(block)) for block in scores)
+
+
+def comb_sum(scores):
+    return sum(np.asarray(block, dtype=float) for block in scores)
+
+
+def comb_mnz(scores):
+    """CombSUM multiplied by the number of scorers giving a file a score"""
+
+    return comb_sum(scores) * sum(np.asarray(block) > 0 for block in scores)
+
+
+def fixed_priors(scores):
+    return sum(prior * np.asarray(block, dtype=float)
+               for prior, block in zip(FIXED_PRIORS, scores))
+
+
+# Fusions which need no estimated parameters
+FUSIONS = {
+    'rrf': reciprocal_rank_fusion,
+    'combsum': comb_sum,
+    'combmnz': comb_mnz,
+    'priors': fixed_priors,
+}
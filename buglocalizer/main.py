@@ -1,3 +1,4 @@
+import cascade
 import preprocessing
 import vsm_similarity
 import token_matching
@@ -6,23 +7,34 @@ import semantic_similarity
 import fixed_bug_reports
 import evaluation
 
-print('Parsing & Preprocessing...')
-preprocessing.main()
 
-print('Token Matching...')
-token_matching.main()
+def main():
+    print('Parsing & Preprocessing...')
+    preprocessing.main()
 
-print('VSM Similarity...')
-vsm_similarity.main()
+    print('Token Matching...')
+    token_matching.main()
 
-print('Stack Trace...')
-stack_trace.main()
+    print('VSM Similarity...')
+    vsm_similarity.main()
 
-print('Semantic Similarity...')
-semantic_similarity.main()
+    print('Stack Trace...')
+    stack_trace.main()
 
-print('Fixed Bug Reports...')
-fixed_bug_reports.main()
+    if cascade.USE_CASCADE:
+        print('Candidate Shortlist...')
+        cascade.main()
 
-print('Evaluating...')
-evaluation.main()
+    print('Semantic Similarity...')
+    semantic_similarity.main()
+
+    print('Fixed Bug Reports...')
+    fixed_bug_reports.main()
+
+    print('Evaluating...')
+    evaluation.main()
+
+
+# Worker processes import this module again when they are spawned
+if __name__ == '__main__':
+    main()
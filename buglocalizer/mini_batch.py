@@ -0,0 +1,166 @@
+import math
+import time
+
+import numpy as np
+
+import artifacts
+import corpus_store
+import evaluation
+import score_store
+
+# Fraction of reports in the first subset, which doubles every
+# GENERATIONS generations until it would include all reports
+FIRST_FRACTION = 0.125
+
+GENERATIONS = 10
+
+# Largest number of generations on all reports after the subsets
+FINAL_GENERATIONS = 20
+
+# Number of chronological strata the subsets are sampled from evenly
+N_STRATA = 10
+
+# Largest difference of MRR and MAP from the estimation on all reports
+# which the benchmark accepts, and largest gain of MRR plus MAP of the
+# final generations over the best parameters of the subsets
+TOLERANCE = 0.01
+
+SEED = 458711526
+
+
+def stratified_order(n_reports, n_strata=N_STRATA, seed=SEED):
+    """A random order of reports where every prefix takes about the same
+    share of reports from each chronological stratum.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    keys = np.empty(n_reports)
+    for stratum in np.array_split(np.arange(n_reports), min(n_strata, n_reports)):
+        keys[stratum] = (rng.permutation(len(stratum)) + rng.random()) / len(stratum)
+
+    return np.argsort(keys, kind='stable')
+
+
+def subset_relevance(relevance, reports):
+    """Relevant files of the given sorted reports, with rows counted in the subset"""
+
+    rows, cols, n_fixed = relevance
+
+    positions = np.full(len(n_fixed), -1)
+    positions[reports] = np.arange(len(reports))
+    kept = positions[rows] >= 0
+
+    return positions[rows[kept]], cols[kept], n_fixed[reports]
+
+
+def subset_rank_scores(rank_scores, reports):
+    """Score rows of the given sorted reports, which are read from the
+    score store if scorer names or row ranges are given.
+    """
+
+    subsets = []
+    for scores in rank_scores:
+        if isinstance(scores, str):
+            subsets.append(score_store.take_rows(scores, reports))
+        elif isinstance(scores, score_store.RowRange):
+            subsets.append(score_store.take_rows(scores.name, reports + scores.start))
+        else:
+            subsets.append(scores[reports])
+
+    return subsets
+
+
+def batch_sizes(n_reports, first_fraction=FIRST_FRACTION):
+    """Sizes of the growing subsets, which are all smaller than the reports"""
+
+    sizes = []
+    fraction = first_fraction
+    while fraction < 1:
+        sizes.append(max(math.ceil(fraction * n_reports), 1))
+        fraction *= 2
+
+    return sizes
+
+
+def initial_population(relevance, rank_scores, generations=GENERATIONS):
+    """Evolving a population on growing stratified subsets of reports,
+    to start the estimation on all reports from it.
+    """
+
+    order = stratified_order(len(relevance[2]))
+
+    population = None
+    for size in batch_sizes(len(order)):
+        reports = np.sort(order[:size])
+
+        options = {'maxiter': generations, 'polish': False}
+        if population is not None:
+            options['init'] = population
+
+        res = evaluation.fit_params(subset_relevance(relevance, reports),
+                                    subset_rank_scores(rank_scores, reports), **options)
+        population = evaluation.final_population(res)
+
+    return population
+
+
+def final_options(population, final_generations=FINAL_GENERATIONS):
+    """Options of the estimation on all reports started from the population"""
+
+    return {'init': population, 'maxiter': final_generations}
+
+
+def check_tolerance(start_cost, res, tolerance=TOLERANCE):
+    """Reporting the gain of the final generations over the best parameters
+    of the subsets (first in the population), which is small when the
+    subsets represent all reports, and whether they converged.
+    """
+
+    gain = start_cost - res.fun
+    print(f'Final generations on all reports: MRR plus MAP {-start_cost:.4f} -> {-res.fun:.4f}, '
+          f'gain {gain:.4f} {"within" if gain <= tolerance else "over"} the tolerance '
+          f'of {tolerance}, {res.nit} generations, {res.message}')
+
+    return gain <= tolerance
+
+
+def benchmark(src_files, bug_reports, *rank_scores):
+    """Comparing the estimation on all reports with the one started on
+    subsets of reports, on time and the final MRR and MAP.
+    """
+
+    relevance = evaluation.relevant_files(src_files, bug_reports)
+
+    results = {}
+    for name in ('full', 'mini-batch'):
+        start = time.perf_counter()
+        options = ({} if name == 'full'
+                   else final_options(initial_population(relevance, rank_scores)))
+        res = evaluation.fit_params(relevance, rank_scores, **options)
+        elapsed = time.perf_counter() - start
+
+        mrr, mean_avgp, *_ = evaluation.block_metrics(
+            relevance, evaluation.final_blocks(res.x, rank_scores))
+        results[name] = (np.mean(mrr), np.mean(mean_avgp))
+
+        print(f'{name}: {elapsed:.2f}s, MRR {np.mean(mrr):.4f}, MAP {np.mean(mean_avgp):.4f}, '
+              f'params {np.round(res.x, 4).tolist()}')
+
+    diff = np.abs(np.subtract(results['full'], results['mini-batch'])).max()
+    print(f'Largest difference {diff:.4f}, '
+          f'{"within" if diff <= TOLERANCE else "over"} the tolerance of {TOLERANCE}')
+
+
+def main():
+    # Only the ids of source files are needed
+    src_files = corpus_store.load_src([])
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    benchmark(src_files, bug_reports, *evaluation.load_rank_scores(
+        'vsm_similarity', 'token_matching', 'fixed_bug_reports',
+        'semantic_similarity', 'stack_trace'))
+
+
+if __name__ == '__main__':
+    main()
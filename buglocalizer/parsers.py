@@ -1,6 +1,7 @@
-import glob
-import os.path
-from collections import OrderedDict
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import javalang
 import pygments
@@ -8,6 +9,11 @@ import xmltodict
 from pygments.lexers import JavaLexer
 from pygments.token import Token
 
+# Number of threads reading source files ahead of the parser, and the
+# number of files read ahead at most
+READ_WORKERS = 8
+PREFETCH_SIZE = 32
+
 
 class BugReport:
     """Class representing each bug report"""
@@ -48,13 +54,18 @@ class SourceFile:
 class Parser:
     """Class containing different parsers"""
 
-    __slots__ = ['name', 'src', 'bug_repo']
+    __slots__ = ['name', 'src', 'bug_repo', 'read_wait', 'parse_time']
 
     def __init__(self, project):
         self.name = project.name
         self.src = project.src
         self.bug_repo = project.bug_repo
 
+        # Seconds the source parser waited for files to be read,
+        # and spent parsing them
+        self.read_wait = 0
+        self.parse_time = 0
+
     def report_parser(self):
         """Parse XML format bug reports"""
 
@@ -81,23 +92,65 @@ class Parser:
 
         return bug_reports
 
-    def src_parser(self):
+    def src_parser(self, src_addresses=None):
         """Parse source code directory of a program and collect
-        its java files.
+        its java files (or only the given ones).
+        """
+
+        return OrderedDict(self.iter_src(src_addresses))
+
+    def walk_src(self):
+        """Java files of the source directory, found while walking it
+        in the same order as a recursive glob.
+        """
+
+        for dir_path, dir_names, file_names in os.walk(self.src, followlinks=True):
+            # Skipping hidden files and directories like glob
+            dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+
+            for name in file_names:
+                if name.endswith('.java') and not name.startswith('.'):
+                    yield os.path.join(dir_path, name)
+
+    @staticmethod
+    def _read(src_file):
+        with open(src_file, encoding='cp1256') as file:
+            return file.read()
+
+    def _prefetch(self, src_addresses):
+        """Reading files in threads ahead of parsing them, yielding
+        the pending reads in order.
         """
 
-        # Getting the list of source files recursively from the source directory
-        src_addresses = glob.glob(str(self.src) + '/**/*.java', recursive=True)
+        with ThreadPoolExecutor(READ_WORKERS) as executor:
+            pending = deque()
+            for src_file in src_addresses:
+                pending.append((src_file, executor.submit(self._read, src_file)))
+                if len(pending) >= PREFETCH_SIZE:
+                    yield pending.popleft()
+
+            while pending:
+                yield pending.popleft()
+
+    def iter_src(self, src_addresses=None):
+        """Parse java files one by one, yielding their ids and objects
+        so that only the raw files read ahead are kept at a time.
+        """
+
+        # Getting the source files recursively from the source directory
+        if src_addresses is None:
+            src_addresses = self.walk_src()
 
         # Creating a java lexer instance for pygments.lex() method
         java_lexer = JavaLexer()
 
-        src_files = OrderedDict()
-
         # Looping to parse each source file
-        for src_file in src_addresses:
-            with open(src_file, encoding='cp1256') as file:
-                src = file.read()
+        for src_file, content in self._prefetch(src_addresses):
+            start = time.perf_counter()
+            src = content.result()
+            self.read_wait += time.perf_counter() - start
+
+            start = time.perf_counter()
 
             # Placeholder for different parts of a source file
             comments = ''
@@ -140,28 +193,23 @@ class Parser:
                 package_name = None
 
             if self.name == 'aspectj':
-                src_files[os.path.relpath(src_file, start=self.src)] = SourceFile(
-                    src, comments, class_names, attributes,
-                    method_names, variables,
-                    [os.path.basename(src_file).split('.')[0]],
-                    package_name
-                )
+                src_id = os.path.relpath(src_file, start=self.src)
+            # If source file has package declaration
+            elif package_name:
+                src_id = (package_name + '.' +
+                          os.path.basename(src_file))
             else:
-                # If source file has package declaration
-                if package_name:
-                    src_id = (package_name + '.' +
-                              os.path.basename(src_file))
-                else:
-                    src_id = os.path.basename(src_file)
-
-                src_files[src_id] = SourceFile(
-                    src, comments, class_names, attributes,
-                    method_names, variables,
-                    [os.path.basename(src_file).split('.')[0]],
-                    package_name
-                )
-
-        return src_files
+                src_id = os.path.basename(src_file)
+
+            source_file = SourceFile(
+                src, comments, class_names, attributes,
+                method_names, variables,
+                [os.path.basename(src_file).split('.')[0]],
+                package_name
+            )
+            self.parse_time += time.perf_counter() - start
+
+            yield src_id, source_file
 
 
 def test():
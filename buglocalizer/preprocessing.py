@@ -1,15 +1,39 @@
-import pickle
+import functools
+import itertools
 import re
 import string
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 import inflection
 import nltk
 from nltk.stem.porter import PorterStemmer
+from nltk.tag.perceptron import PerceptronTagger
 
+import artifacts
+import corpus_store
 from assets import java_keywords, stop_words
 from datasets import DATASET
 from parsers import Parser
 
+# Number of worker processes preprocessing shards of reports and
+# source files (1 preprocesses them in this process)
+N_WORKERS = 1
+
+# Number of reports or source files in each shard given to a worker
+SHARD_SIZE = 32
+
+# Number of shards each worker is given ahead, bounding the parsed
+# raw text waiting in memory
+SHARDS_PER_WORKER = 4
+
+
+@functools.lru_cache(maxsize=None)
+def _tagger():
+    """POS tagger, loaded once in each process"""
+
+    return PerceptronTagger()
+
 
 class ReportPreprocessing:
     """Class to preprocess bug reports"""
@@ -43,8 +67,8 @@ class ReportPreprocessing:
             # Tokenizing using word_tokeize for more accurate pos-tagging
             summ_tok = nltk.word_tokenize(report.summary)
             desc_tok = nltk.word_tokenize(report.description)
-            sum_pos = nltk.pos_tag(summ_tok)
-            desc_pos = nltk.pos_tag(desc_tok)
+            sum_pos = _tagger().tag(summ_tok)
+            desc_pos = _tagger().tag(desc_tok)
 
             report.pos_tagged_summary = [token for token, pos in sum_pos
                                          if 'NN' in pos or 'VB' in pos]
@@ -200,7 +224,7 @@ class SrcPreprocessing:
 
             # Tokenizing using word_tokeize for more accurate pos-tagging
             comments_tok = nltk.word_tokenize(src.comments)
-            comments_pos = nltk.pos_tag(comments_tok)
+            comments_pos = _tagger().tag(comments_tok)
 
             src.pos_tagged_comments = [token for token, pos in comments_pos
                                        if 'NN' in pos or 'VB' in pos]
@@ -387,20 +411,72 @@ class SrcPreprocessing:
         self.stem()
 
 
-def main():
+# Indexes built from the preprocessed source files by the scorers
+SRC_INDEXES = ['vsm_index.pickle', 'token_index.pickle', 'trace_index.pickle',
+               'semantic_src_vectors.npz', 'semantic_ann.npz']
 
-    parser = Parser(DATASET)
 
-    src_prep = SrcPreprocessing(parser.src_parser())
+def _preprocess_src(src_files):
+    src_prep = SrcPreprocessing(src_files)
     src_prep.preprocess()
-    with open(DATASET.root / 'preprocessed_src.pickle', 'wb') as file:
-        pickle.dump(src_prep.src_files, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return src_prep.src_files
+
 
-    report_prep = ReportPreprocessing(parser.report_parser())
+def _preprocess_reports(bug_reports):
+    report_prep = ReportPreprocessing(bug_reports)
     report_prep.preprocess()
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'wb') as file:
-        pickle.dump(report_prep.bug_reports, file,
-                    protocol=pickle.HIGHEST_PROTOCOL)
+    return report_prep.bug_reports
+
+
+def _shards(items, shard_size):
+    items = iter(items)
+    while shard := OrderedDict(itertools.islice(items, shard_size)):
+        yield shard
+
+
+def preprocess_stream(items, preprocess, n_workers=None):
+    """Preprocessing reports or source files as they are parsed, yielding
+    them in order. Worker processes (N_WORKERS by default) preprocess
+    shards of them, otherwise they are preprocessed one by one so that
+    only the raw text of one of them is kept at a time.
+    """
+
+    n_workers = N_WORKERS if n_workers is None else n_workers
+
+    if n_workers <= 1:
+        for shard in _shards(items, 1):
+            yield from preprocess(shard).items()
+        return
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        pending = deque()
+        for shard in _shards(items, SHARD_SIZE):
+            pending.append(executor.submit(preprocess, shard))
+            if len(pending) >= n_workers * SHARDS_PER_WORKER:
+                yield from pending.popleft().result().items()
+
+        while pending:
+            yield from pending.popleft().result().items()
+
+
+def main():
+
+    parser = Parser(DATASET)
+
+    src_files = OrderedDict(preprocess_stream(parser.iter_src(), _preprocess_src))
+    artifacts.save('preprocessed_src', src_files)
+    corpus_store.save_src(src_files)
+
+    print(f'Source files read wait: {parser.read_wait:.2f}s, '
+          f'parsing: {parser.parse_time:.2f}s')
+
+    # Indexes of the previous source files are outdated
+    for index in SRC_INDEXES:
+        (DATASET.root / index).unlink(missing_ok=True)
+
+    bug_reports = OrderedDict(preprocess_stream(parser.report_parser().items(),
+                                                _preprocess_reports))
+    artifacts.save('preprocessed_reports', bug_reports)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,257 @@
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+
+import artifacts
+import cascade
+import evaluation
+import fixed_bug_reports
+import semantic_similarity
+from ann_index import normalize_rows
+from datasets import DATASET, RESULTS_ROOT
+from parsers import Parser
+from preprocessing import ReportPreprocessing
+from stack_trace import TraceIndex
+from token_matching import TokenIndex
+from vsm_similarity import Similarity
+from word_vectors import WordVectors
+
+# Number of reports replayed from the start of the repository
+# (None replays all of them)
+LIMIT = None
+
+# Reports at the start which are left out of the latency statistics,
+# while the caches of the scorers warm up
+WARMUP = 5
+
+# Number of reports between the samples of memory use
+MEMORY_INTERVAL = 50
+
+# Tracing the Python allocations, which shows the growth of the heap
+# more precisely than the peak RSS but slows down the replay
+TRACE_MALLOC = False
+
+PERCENTILES = (50, 90, 99)
+
+# Largest relative increase of a latency percentile over the baseline
+# run before it's reported as a regression
+REGRESSION_TOLERANCE = 0.2
+
+# Stages of localizing a report, in the order they run
+STAGES = ('preprocessing', 'token_matching', 'vsm_similarity', 'stack_trace',
+          'semantic_similarity', 'fixed_bug_reports', 'combination')
+
+
+class OnlineLocalizer:
+    """The scorers of the source files, loaded once to localize new bug
+    reports one at a time, where each localized report becomes a
+    previously fixed report of the next ones.
+    """
+
+    __slots__ = ['src_keys', 'tokens', 'vsm', 'traces', 'vectorizer', 'src_docs',
+                 'ann_index', 'params', 'fixed']
+
+    def __init__(self, src_files, params):
+        self.src_keys = list(src_files)
+        self.tokens = TokenIndex.load(src_files)
+        self.vsm = Similarity.load(src_files)
+        self.traces = TraceIndex.load(src_files)
+
+        self.vectorizer = semantic_similarity.load_vectorizer(src_files, {})
+        self.src_docs = normalize_rows(
+            semantic_similarity.src_vectors(self.vectorizer, src_files))
+        self.ann_index = None
+        if semantic_similarity.USE_ANN_INDEX and not cascade.USE_CASCADE:
+            self.ann_index = semantic_similarity.load_ann_index(self.src_docs)
+
+        self.params = params
+        self.fixed = fixed_bug_reports.FixedBugModel(self.src_keys)
+
+    def _report_vectors(self, reports):
+        # Words of new reports which aren't in the word-vector table are
+        # exported to it before they're looked up
+        if isinstance(self.vectorizer, WordVectors) and any(
+                word not in self.vectorizer.rows for report in reports.values()
+                for word in semantic_similarity.report_words(report)):
+            self.vectorizer = semantic_similarity.load_vectorizer({}, reports)
+
+        return normalize_rows(semantic_similarity.report_vectors(self.vectorizer, reports))
+
+    def localize(self, bug_id, report, timings):
+        """Ranked source files of a new report, adding the time of each
+        stage to the timings.
+        """
+
+        reports = OrderedDict([(bug_id, report)])
+
+        def timed(stage, score, *args):
+            start = time.perf_counter()
+            result = score(*args)
+            timings[stage] = time.perf_counter() - start
+            return result
+
+        timed('preprocessing', ReportPreprocessing(reports).preprocess)
+
+        token_matching_score = timed('token_matching', self.tokens.check_matchings, reports)
+        vsm_similarity_score = timed('vsm_similarity', self.vsm.find_similars, reports)
+        stack_trace_score = timed('stack_trace', self.traces.get_traces_score, reports)
+
+        # Picking the shortlist is counted in the semantic stage
+        # which is the first to use it
+        def semantic_scores():
+            shortlist = None
+            if cascade.USE_CASCADE:
+                shortlist = cascade.shortlist(cascade.SHORTLIST_SIZE, token_matching_score,
+                                              vsm_similarity_score, stack_trace_score)
+            return shortlist, list(semantic_similarity.semantic_scores(
+                self.src_docs, self._report_vectors(reports), shortlist, self.ann_index))
+
+        shortlist, semantic_similarity_score = timed('semantic_similarity', semantic_scores)
+        fixed_bug_reports_score = timed('fixed_bug_reports', lambda: list(
+            fixed_bug_reports.iter_model_clf(reports, shortlist, model=self.fixed)))
+
+        def rank():
+            final_scores = evaluation.combine_rank_scores(
+                self.params, vsm_similarity_score, token_matching_score,
+                fixed_bug_reports_score, semantic_similarity_score, stack_trace_score)[0]
+            return np.argsort(-final_scores, kind='stable')[:evaluation.OUTPUT_TOP_K]
+
+        ranks = timed('combination', rank)
+
+        return [self.src_keys[i] for i in ranks]
+
+
+def _memory_sample():
+    """Peak RSS in MB, and the traced heap in MB when tracing"""
+
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    heap = tracemalloc.get_traced_memory()[0] / 2 ** 20 if tracemalloc.is_tracing() else np.nan
+
+    return peak_rss, heap
+
+
+def replay(src_files, bug_reports, params):
+    """Localizing the reports one by one in the order of the repository,
+    returning the latency of each stage and the total latency of each
+    report, with the memory samples and the replay time.
+    """
+
+    if TRACE_MALLOC:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    localizer = OnlineLocalizer(src_files, params)
+    print(f'Scorers loaded in {time.perf_counter() - start:.2f}s')
+
+    latencies = np.empty((len(bug_reports), len(STAGES) + 1))
+    memory = [(0, *_memory_sample())]
+
+    start = time.perf_counter()
+    for i, (bug_id, report) in enumerate(bug_reports.items()):
+        timings = {}
+        report_start = time.perf_counter()
+        localizer.localize(bug_id, report, timings)
+        latencies[i, -1] = time.perf_counter() - report_start
+        latencies[i, :-1] = [timings[stage] for stage in STAGES]
+
+        if (i + 1) % MEMORY_INTERVAL == 0 or i + 1 == len(bug_reports):
+            memory.append((i + 1, *_memory_sample()))
+
+    elapsed = time.perf_counter() - start
+
+    if TRACE_MALLOC:
+        tracemalloc.stop()
+
+    return latencies, np.array(memory), elapsed
+
+
+def latency_percentiles(latencies, warmup=WARMUP):
+    """Percentiles of the latencies of each stage and of the total in ms,
+    leaving out the warmup reports when there are more reports.
+    """
+
+    if len(latencies) > warmup:
+        latencies = latencies[warmup:]
+
+    return np.percentile(latencies * 1000, PERCENTILES, axis=0).T
+
+
+def save_replay(name, latencies, memory, elapsed):
+    np.savez(RESULTS_ROOT / f'{DATASET.name}_{name}_replay.npz',
+             latencies=latencies, memory=memory, elapsed=elapsed)
+
+
+def load_replay(name):
+    with np.load(RESULTS_ROOT / f'{DATASET.name}_{name}_replay.npz') as replay_file:
+        return replay_file['latencies'], replay_file['memory'], replay_file['elapsed']
+
+
+def print_replay(latencies, memory, elapsed):
+    n_reports = len(latencies)
+    print(f'{n_reports} reports in {elapsed:.2f}s, {n_reports / elapsed:.2f} reports/s')
+
+    print(f'{"stage":<20}' + ''.join(f'{f"p{p} ms":>12}' for p in PERCENTILES)
+          + f'{"max ms":>12}')
+    for stage, percentiles, longest in zip(STAGES + ('total',), latency_percentiles(latencies),
+                                           latencies.max(axis=0) * 1000):
+        print(f'{stage:<20}' + ''.join(f'{value:>12.2f}' for value in percentiles)
+              + f'{longest:>12.2f}')
+
+    # Growing memory with the number of reports shows state which is
+    # kept across reports
+    for n, peak_rss, heap in memory:
+        print(f'after {int(n)} reports: peak RSS {peak_rss:.1f}MB'
+              + ('' if np.isnan(heap) else f', heap {heap:.1f}MB'))
+    print(f'Peak RSS growth: {memory[-1, 1] - memory[0, 1]:.1f}MB')
+
+
+def compare_replays(latencies, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Stages whose latency percentiles are higher than the ones of the
+    baseline by more than the tolerance, with the percentile and both values.
+    """
+
+    regressions = []
+    for stage, percentiles, baseline_percentiles in zip(
+            STAGES + ('total',), latency_percentiles(latencies), latency_percentiles(baseline)):
+        for p, value, baseline_value in zip(PERCENTILES, percentiles, baseline_percentiles):
+            if value > baseline_value * (1 + tolerance):
+                regressions.append((stage, p, value, baseline_value))
+
+    return regressions
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else 'replay'
+    baseline_name = sys.argv[2] if len(sys.argv) > 2 else None
+
+    src_files = artifacts.load('preprocessed_src')
+
+    # Raw reports are replayed, so their preprocessing is measured too
+    bug_reports = Parser(DATASET).report_parser()
+    if LIMIT is not None:
+        bug_reports = OrderedDict(list(bug_reports.items())[:LIMIT])
+
+    with open(DATASET.root / 'params.json', 'r') as file:
+        params = json.load(file)
+
+    latencies, memory, elapsed = replay(src_files, bug_reports, params)
+    save_replay(name, latencies, memory, elapsed)
+    print_replay(latencies, memory, elapsed)
+
+    if baseline_name is not None:
+        regressions = compare_replays(latencies, load_replay(baseline_name)[0])
+        for stage, p, value, baseline_value in regressions:
+            print(f'Regression of {stage} p{p}: {value:.2f}ms '
+                  f'against {baseline_value:.2f}ms of {baseline_name}')
+        if not regressions:
+            print(f'No regression against {baseline_name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import hashlib
+
+import numpy as np
+
+from datasets import DATASET
+
+# Number of report rows written or read at once
+CHUNK_SIZE = 1000
+
+# Reading scores chunk by chunk in the evaluation instead of
+# loading them all in memory
+STREAMING = False
+
+# Resuming interrupted stages from their checkpoints, keeping the
+# chunks of scores which are already saved
+RESUME = False
+
+# Precision of the stored scores and of their combination in the
+# evaluation (float64, float32 or float16)
+DTYPE = 'float64'
+
+# Storing the scores in float64 whatever the precision is, so the
+# evaluation can report the rank changes of the precision against them
+VERIFY_PRECISION = False
+
+# Score matrices saved or loaded in this process, which are kept in
+# memory for the next stages of the pipeline unless streaming
+_scores = {}
+
+
+def min_max_rows(scores, low=None, high=None):
+    """Min-max scaling each row of a block of scores (or a single row),
+    where rows with a range below 10 eps are left unscaled like in the
+    sklearn scaler. The range of rows can be given when the scores are
+    a part of longer rows.
+    """
+
+    scores = np.asarray(scores, dtype=float)
+
+    low = scores.min(axis=-1, keepdims=True) if low is None else np.asarray(low, dtype=float)
+    high = scores.max(axis=-1, keepdims=True) if high is None else np.asarray(high, dtype=float)
+    span = np.asarray(high - low)
+    span[span < 10 * np.finfo(span.dtype).eps] = 1
+    scale = 1 / span
+
+    return scores * scale - low * scale
+
+
+def _store_dtype():
+    return 'float64' if VERIFY_PRECISION else DTYPE
+
+
+def _score_dir(name):
+    return DATASET.root / 'scores' / name
+
+
+def _chunks(name):
+    """Chunk files of a score matrix in the order of their first row"""
+
+    return sorted(_score_dir(name).glob('*.npy'))
+
+
+def _save_chunk(name, first_row, chunk):
+    """Saving a chunk completely or not at all, so the saved chunks of
+    an interrupted stage can be kept
+    """
+
+    chunk = np.asarray(chunk, dtype=_store_dtype())
+
+    path = _score_dir(name) / f'{first_row:08d}.npy'
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as file:
+        np.save(file, chunk)
+    tmp_path.replace(path)
+
+    return chunk
+
+
+def _write_chunks(name, rows, first_row, chunk_size):
+    """Writing rows as soon as a chunk of them is ready, yielding the
+    saved chunks.
+    """
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield _save_chunk(name, first_row, chunk)
+            first_row += len(chunk)
+            chunk = []
+
+    if chunk:
+        yield _save_chunk(name, first_row, chunk)
+
+
+def stage_fingerprint(*parts):
+    """Hash of what the scores of a stage depend on, like the ids of the
+    source files and reports and the config of the scorer, together with
+    the stored precision. Arrays are hashed by their content.
+    """
+
+    fingerprint = hashlib.sha1(_store_dtype().encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            fingerprint.update(np.ascontiguousarray(part))
+        else:
+            fingerprint.update(repr(part).encode())
+
+    return fingerprint.hexdigest()
+
+
+def _fingerprint_path(name):
+    return _score_dir(name) / 'fingerprint.txt'
+
+
+def resume_row(name, fingerprint):
+    """First report row of a scorer to compute, which is after the saved
+    rows of an interrupted stage when resuming a stage with the same
+    fingerprint, or the first row otherwise.
+    """
+
+    path = _fingerprint_path(name)
+    if not RESUME or not path.exists() or path.read_text() != fingerprint:
+        return 0
+
+    return n_rows(name)
+
+
+def save_scores(name, rows, chunk_size=None, first_row=0, fingerprint=None):
+    """Saving the score rows of a scorer in chunks (of CHUNK_SIZE rows
+    by default), replacing the previous ones except the rows before the
+    first row, which are kept when resuming. The fingerprint of the stage
+    is saved with them to resume it.
+    """
+
+    chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+
+    score_dir = _score_dir(name)
+    score_dir.mkdir(parents=True, exist_ok=True)
+
+    # Rows of a stage without a fingerprint are never resumed
+    path = _fingerprint_path(name)
+    if fingerprint is None:
+        path.unlink(missing_ok=True)
+    else:
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(fingerprint)
+        tmp_path.replace(path)
+
+    kept = [load_rows(name, 0, first_row)] if first_row and not STREAMING else []
+    for chunk in _chunks(name):
+        if int(chunk.stem) >= first_row:
+            chunk.unlink()
+
+    chunks = _write_chunks(name, rows, first_row, chunk_size)
+
+    if STREAMING:
+        for _ in chunks:
+            pass
+    else:
+        chunks = kept + list(chunks)
+        _scores[score_dir] = (np.concatenate(chunks) if chunks
+                              else np.empty(0, dtype=_store_dtype()))
+
+
+def n_rows(name):
+    """Number of report rows stored for a scorer"""
+
+    return sum(np.load(chunk, mmap_mode='r').shape[0] for chunk in _chunks(name))
+
+
+def append_scores(name, rows, chunk_size=None):
+    """Appending the rows of new reports as new chunks"""
+
+    chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+
+    # The stored rows are no longer the ones of the saved stage
+    _fingerprint_path(name).unlink(missing_ok=True)
+
+    _scores.pop(_score_dir(name), None)
+    for _ in _write_chunks(name, rows, n_rows(name), chunk_size):
+        pass
+
+
+def load_scores(name):
+    score_dir = _score_dir(name)
+
+    if score_dir in _scores:
+        return _scores[score_dir]
+
+    scores = np.concatenate([np.load(chunk) for chunk in _chunks(name)])
+    if not STREAMING:
+        _scores[score_dir] = scores
+
+    return scores
+
+
+def load_rows(name, start, stop):
+    """Reading a range of report rows from the memory-mapped chunks"""
+
+    rows = []
+    offset = 0
+    for chunk in _chunks(name):
+        chunk = np.load(chunk, mmap_mode='r')
+        if offset < stop and offset + len(chunk) > start:
+            rows.append(chunk[max(start - offset, 0):stop - offset])
+        offset += len(chunk)
+
+    return np.concatenate(rows)
+
+
+def take_rows(name, rows):
+    """Reading the given sorted report rows from the memory-mapped chunks"""
+
+    taken = []
+    offset = 0
+    for chunk in _chunks(name):
+        chunk = np.load(chunk, mmap_mode='r')
+        lo, hi = np.searchsorted(rows, [offset, offset + len(chunk)])
+        taken.append(chunk[rows[lo:hi] - offset])
+        offset += len(chunk)
+
+    return np.concatenate(taken)
+
+
+class RowRange:
+    """A range of report rows of a stored score matrix, which is read
+    block by block from the memory-mapped chunks like a scorer name
+    """
+
+    __slots__ = ['name', 'start', 'stop']
+
+    def __init__(self, name, start, stop):
+        self.name = name
+        self.start = start
+        self.stop = stop
+
+
+def iter_blocks(names, block_size=None):
+    """Reading blocks of rows (CHUNK_SIZE by default) of several scorers
+    (or row ranges of them) in lockstep, where blocks within a chunk are
+    views of its memory map
+    """
+
+    block_size = CHUNK_SIZE if block_size is None else block_size
+
+    ranges = [(scores.name, scores.start, scores.stop) if isinstance(scores, RowRange)
+              else (scores, 0, None) for scores in names]
+
+    matrices = []
+    for name, first, last in ranges:
+        chunks = [np.load(chunk, mmap_mode='r') for chunk in _chunks(name)]
+        offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+        matrices.append((chunks, offsets, first, offsets[-1] if last is None else last))
+
+    n_rows = matrices[0][3] - matrices[0][2]
+    for start in range(0, n_rows, block_size):
+
+        blocks = []
+        for chunks, offsets, first, last in matrices:
+            lo, hi = first + start, min(first + start + block_size, last)
+            parts = [chunk[max(lo - offset, 0):hi - offset]
+                     for chunk, offset in zip(chunks, offsets)
+                     if offset < hi and offset + len(chunk) > lo]
+            blocks.append(parts[0] if len(parts) == 1 else np.concatenate(parts))
+
+        yield start, blocks
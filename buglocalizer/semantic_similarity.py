@@ -1,59 +1,223 @@
 import warnings
 warnings.simplefilter(action="ignore")
 
-import json
-import pickle
+import itertools
+from collections import OrderedDict
 
-import spacy
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
 
+import artifacts
+import cascade
+import corpus_store
+import score_store
+from ann_index import IVFIndex, normalize_rows, vectors_digest
 from datasets import DATASET
+from word_vectors import SpacyVectors, WordVectors
 
+# Searching only the nearest source files using an approximate index
+USE_ANN_INDEX = False
 
-def calculate_similarity(src_files, bug_reports):
+# Number of source files scored for each report by the index,
+# and the number of index lists searched (higher is more accurate)
+ANN_TOP_K = 1000
+ANN_N_PROBE = 16
 
-    # Loading word vectors
-    nlp = spacy.load('en_core_web_lg')
+# Building document vectors from the exported word-vector table of the
+# corpus instead of loading the spaCy model
+USE_VECTOR_TABLE = False
+
+
+# Columns of preprocessed source files needed for their vectors
+SRC_COLUMNS = ['file_name.unstemmed', 'class_names.unstemmed', 'attributes.unstemmed',
+               'comments.unstemmed', 'method_names.unstemmed']
+
+
+def src_words(src):
+    return (src.file_name['unstemmed'] + src.class_names['unstemmed']
+            + src.attributes['unstemmed'] + src.comments['unstemmed']
+            + src.method_names['unstemmed'])
+
+
+def report_words(report):
+    return report.summary['unstemmed'] + report.pos_tagged_description['unstemmed']
 
-    src_docs = [nlp(' '.join(src.file_name['unstemmed'] + src.class_names['unstemmed']
-                             + src.attributes['unstemmed']
-                             + src.comments['unstemmed']
-                             + src.method_names['unstemmed']))
-                for src in src_files.values()]
 
-    min_max_scaler = MinMaxScaler()
+def load_vectorizer(src_files, bug_reports, export=True):
+    """The word-vector table with the words of the given documents,
+    or the spaCy model if the table isn't used. Without exporting, the
+    table must already have the words.
+    """
 
-    all_simis = []
+    if not USE_VECTOR_TABLE:
+        return SpacyVectors()
+
+    words = set()
+    for src in src_files.values():
+        words.update(src_words(src))
     for report in bug_reports.values():
-        report_doc = nlp(' '.join(report.summary['unstemmed']
-                                  + report.pos_tagged_description['unstemmed']))
-        scores = []
-        for src_doc in src_docs:
-            simi = report_doc.similarity(src_doc)
-            scores.append(simi)
+        words.update(report_words(report))
+
+    return WordVectors.load(words, export)
+
+
+def src_vectors(vectorizer, src_files, needed=None):
+    """Averaged word vectors of source files (only the needed ones if given),
+    which are cached to be computed once.
+    """
+
+    cache_path = DATASET.root / 'semantic_src_vectors.npz'
+    src_keys = list(src_files)
+    src_files = list(src_files.values())
+
+    vectors = np.zeros((len(src_files), vectorizer.size), dtype=np.float32)
+    computed = np.zeros(len(src_files), dtype=bool)
+
+    # The cache is valid only for the same source files
+    # and vectors of the same model
+    if cache_path.exists():
+        with np.load(cache_path) as cache:
+            if (cache['src_keys'].tolist() == src_keys
+                    and str(cache['digest']) == vectorizer.digest):
+                vectors = cache['vectors']
+                computed = cache['computed']
+
+    needed = np.arange(len(src_files)) if needed is None else np.asarray(needed)
+    missing = needed[~computed[needed]]
+
+    for i in missing:
+        vectors[i] = vectorizer.doc_vector(src_words(src_files[i]))
+    computed[missing] = True
+
+    if len(missing):
+        np.savez(cache_path, src_keys=np.array(src_keys), digest=vectorizer.digest,
+                 vectors=vectors, computed=computed)
+
+    return vectors
+
+
+def update_src_vectors(src_files, changed):
+    """Keeping the cached vectors of the source files which are not
+    changed, so only the changed ones are computed later.
+    """
+
+    cache_path = DATASET.root / 'semantic_src_vectors.npz'
+    if not cache_path.exists():
+        return
+
+    with np.load(cache_path) as cache:
+        cached = {src_id: i for i, src_id in enumerate(cache['src_keys'].tolist())}
+        cached_vectors = cache['vectors']
+        cached_computed = cache['computed']
+        digest = cache['digest']
+
+    src_keys = list(src_files)
+    positions = np.array([-1 if src_id in changed else cached.get(src_id, -1)
+                          for src_id in src_keys], dtype=np.int64)
+    kept = positions >= 0
+
+    vectors = np.zeros((len(src_keys), cached_vectors.shape[1]), dtype=np.float32)
+    computed = np.zeros(len(src_keys), dtype=bool)
+    vectors[kept] = cached_vectors[positions[kept]]
+    computed[kept] = cached_computed[positions[kept]]
+
+    np.savez(cache_path, src_keys=np.array(src_keys), digest=digest,
+             vectors=vectors, computed=computed)
 
-        scores = np.array([float(count) for count in scores]).reshape(-1, 1)
-        normalized_scores = np.concatenate(
-            min_max_scaler.fit_transform(scores)
-        )
+    # The approximate index is built again for the new vectors
+    (DATASET.root / 'semantic_ann.npz').unlink(missing_ok=True)
 
-        all_simis.append(normalized_scores.tolist())
 
-    return all_simis
+def report_vectors(vectorizer, bug_reports):
+    """Averaged word vectors of bug reports"""
+
+    return np.array([vectorizer.doc_vector(report_words(report))
+                     for report in bug_reports.values()])
+
+
+def load_ann_index(vectors):
+    """Loading the approximate index of source vectors, building
+    it again if it doesn't exist or was built on other vectors.
+    """
+
+    index_path = DATASET.root / 'semantic_ann.npz'
+
+    if index_path.exists():
+        index = IVFIndex.load(index_path)
+        if index.digest == vectors_digest(vectors):
+            return index
+
+    index = IVFIndex.build(vectors)
+    index.save(index_path)
+
+    return index
+
+
+def iter_similarity(src_files, bug_reports, shortlist=None, start=0):
+    """Yielding the semantic similarity scores of reports one by one,
+    starting from the start report when resuming.
+    """
+
+    bug_reports = OrderedDict(itertools.islice(bug_reports.items(), start, None))
+
+    # Loading word vectors
+    vectorizer = load_vectorizer(src_files, bug_reports)
+
+    # Only the candidate source files are needed in a cascade
+    needed = None if shortlist is None else np.unique(shortlist[start:])
+
+    src_docs = normalize_rows(src_vectors(vectorizer, src_files, needed))
+    report_docs = normalize_rows(report_vectors(vectorizer, bug_reports))
+
+    index = load_ann_index(src_docs) if USE_ANN_INDEX and shortlist is None else None
+
+    return semantic_scores(src_docs, report_docs, shortlist, index, start)
+
+
+def semantic_scores(src_docs, report_docs, shortlist=None, index=None, start=0):
+    """Yielding the scores of normalized report vectors one by one,
+    where the shortlist rows are counted from the start report.
+    """
+
+    for i, report_doc in enumerate(report_docs, start):
+
+        # Only the candidates or the files found by the index are
+        # scored, and the rest of the files get zero
+        if shortlist is not None:
+            candidates = shortlist[i]
+            scores = src_docs[candidates] @ report_doc
+        elif index is not None:
+            candidates, scores = index.search(report_doc, ANN_TOP_K, ANN_N_PROBE)
+        else:
+            candidates = slice(None)
+            scores = src_docs @ report_doc
+
+        normalized_scores = np.zeros(len(src_docs))
+        normalized_scores[candidates] = score_store.min_max_rows(scores)
+
+        yield normalized_scores
+
+
+def calculate_similarity(src_files, bug_reports, shortlist=None):
+    return list(iter_similarity(src_files, bug_reports, shortlist))
 
 
 def main():
 
-    with open(DATASET.root / 'preprocessed_src.pickle', 'rb') as file:
-        src_files = pickle.load(file)
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'rb') as file:
-        bug_reports = pickle.load(file)
+    src_files = corpus_store.load_src(SRC_COLUMNS)
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    shortlist = cascade.load_shortlist() if cascade.USE_CASCADE else None
 
-    all_simis = calculate_similarity(src_files, bug_reports)
+    # Continuing after the saved rows of an interrupted run when resuming
+    # on the same source files, reports and config
+    fingerprint = score_store.stage_fingerprint(
+        list(src_files), list(bug_reports), USE_VECTOR_TABLE, USE_ANN_INDEX, ANN_TOP_K,
+        ANN_N_PROBE, shortlist)
+    start = score_store.resume_row('semantic_similarity', fingerprint)
+    all_simis = iter_similarity(src_files, bug_reports, shortlist, start)
 
-    with open(DATASET.root / 'semantic_similarity.json', 'w') as file:
-        json.dump(all_simis, file)
+    score_store.save_scores('semantic_similarity', all_simis, first_row=start,
+                            fingerprint=fingerprint)
 
 
 if __name__ == '__main__':
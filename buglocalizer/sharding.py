@@ -0,0 +1,374 @@
+import ipaddress
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+import artifacts
+import corpus_store
+import score_store
+import semantic_similarity
+import stack_trace
+import token_matching
+import vsm_similarity
+from ann_index import normalize_rows
+
+# Number of shards the source files are split into
+N_SHARDS = 4
+
+# Addresses (host, port) of shard servers started on other hosts with
+# `sharding.py serve <host> <port>` (with the key in AUTHKEY_VARIABLE),
+# in the order of shards, or None to start a local worker process for
+# each shard
+SHARD_ADDRESSES = None
+
+# Environment variable holding the secret key shared by the shard servers
+# and the scoring process. Servers unpickle and run the calls of anyone
+# who has the key, so it has no default, and local workers use the random
+# key of the scoring process instead
+AUTHKEY_VARIABLE = 'BUGLOCALIZER_SHARD_KEY'
+
+# Number of the best source files of each shard kept for a report
+# (None keeps all of them, which gives the same scores as one index)
+TOP_K = None
+
+# Number of reports sent to the shards in one request
+BATCH_SIZE = 64
+
+# Scorers of the shards. Shards only read the word-vector table of the
+# semantic scorer if it's used, which the scoring process exports for the
+# corpus before starting local workers (servers on other hosts need it
+# exported with word_vectors.py)
+SCORERS = ('vsm_similarity', 'token_matching', 'stack_trace', 'semantic_similarity')
+
+# Scores which are min-max scaled over all source files of a report
+_NORMALIZED = ('vsm_similarity', 'token_matching', 'semantic_similarity')
+
+
+def shard_bounds(n_src, n_shards=N_SHARDS):
+    """First and last source file of each shard"""
+
+    sizes = [len(part) for part in np.array_split(np.arange(n_src), min(n_shards, n_src))]
+    bounds = np.cumsum([0] + sizes).tolist()
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _top_k(scores, top_k):
+    """Positions and scores of the best files of each report (None
+    positions for all files), with the range of scores of reports.
+    """
+
+    scores = np.asarray(scores, dtype=float)
+    low, high = scores.min(axis=1), scores.max(axis=1)
+
+    if top_k is None or top_k >= scores.shape[1]:
+        return None, scores, low, high
+
+    positions = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+
+    return positions, np.take_along_axis(scores, positions, axis=1), low, high
+
+
+class ShardIndex:
+    """Indexes of a shard of source files, served by a worker process.
+    Reports are scored with the statistics of the whole corpus, and the
+    best files are returned before normalization.
+    """
+
+    __slots__ = ['vsm', 'tokens', 'traces', 'src_docs', '_src_tfidf', '_src_len_score']
+
+    def __init__(self, first, last, scorers, n_features=None):
+        columns = set()
+        for name, index in (('vsm_similarity', vsm_similarity.Similarity),
+                            ('token_matching', token_matching.TokenIndex),
+                            ('stack_trace', stack_trace.TraceIndex)):
+            if name in scorers:
+                columns.update(index.SRC_COLUMNS)
+        if 'semantic_similarity' in scorers:
+            columns.update(semantic_similarity.SRC_COLUMNS)
+
+        src_files = corpus_store.load_src(sorted(columns), first, last)
+
+        self.vsm = self.tokens = self.traces = self.src_docs = None
+        self._src_tfidf = self._src_len_score = None
+
+        if 'vsm_similarity' in scorers:
+            self.vsm = vsm_similarity.Similarity(src_files, n_features)
+        if 'token_matching' in scorers:
+            self.tokens = token_matching.TokenIndex(src_files)
+        if 'stack_trace' in scorers:
+            self.traces = stack_trace.TraceIndex(src_files)
+        if 'semantic_similarity' in scorers:
+            vectorizer = semantic_similarity.load_vectorizer(src_files, {}, export=False)
+            self.src_docs = normalize_rows(np.array(
+                [vectorizer.doc_vector(semantic_similarity.src_words(src))
+                 for src in src_files.values()], dtype=np.float32))
+
+    def vsm_stats(self):
+        """Terms and document frequencies, and the number and the range
+        of lengths of the source files of the shard.
+        """
+
+        lengths = [length for _, _, length in self.vsm.src_terms.values()]
+
+        return (list(self.vsm.vocabulary), self.vsm.doc_freq,
+                len(lengths), min(lengths), max(lengths))
+
+    def set_vsm_stats(self, term_map, idf, low, high):
+        """Weighting the source files with the idf and the length range
+        of the whole corpus, where term ids are mapped to its vocabulary.
+        """
+
+        self._src_tfidf = vsm_similarity.sublinear_tfidf(
+            [(term_ids if term_map is None else term_map[term_ids], counts)
+             for term_ids, counts, _ in self.vsm.src_terms.values()], idf)
+
+        self._src_len_score = vsm_similarity.length_scores(
+            [length for _, _, length in self.vsm.src_terms.values()], low, high)
+
+    def vsm_scores(self, reports_tfidf, top_k):
+        return _top_k(vsm_similarity.rvsm_scores(reports_tfidf, self._src_tfidf,
+                                                 self._src_len_score), top_k)
+
+    def summary_matched(self, bug_reports):
+        """Whether any file of the shard matches the summary of reports"""
+
+        return [self.tokens.summary_matches(report).sum() > 0
+                for report in bug_reports.values()]
+
+    def token_scores(self, bug_reports, matched, top_k):
+        """Token matching scores, where reports are matched by their
+        summary if any file of the corpus matched it.
+        """
+
+        return _top_k([self.tokens.summary_matches(report) if summary_matched
+                       else self.tokens.token_matches(report)
+                       for report, summary_matched in zip(bug_reports.values(), matched)],
+                      top_k)
+
+    def file_names(self):
+        return set(self.traces.by_name)
+
+    def trace_scores(self, traces, top_k):
+        return _top_k([self.traces.trace_scores(stack_traces) for stack_traces in traces],
+                      top_k)
+
+    def semantic_scores(self, report_docs, top_k):
+        return _top_k([self.src_docs @ report_doc for report_doc in report_docs], top_k)
+
+
+def shared_authkey():
+    """The secret key of shard servers from the environment"""
+
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    if not key:
+        raise ValueError(f'Set {AUTHKEY_VARIABLE} to a secret key shared by '
+                         f'the shard servers and the scoring process')
+
+    return key.encode()
+
+
+def is_loopback(host):
+    """Whether a host name or address only accepts local connections"""
+
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class ShardManager(BaseManager):
+    pass
+
+
+ShardManager.register('ShardIndex', ShardIndex)
+
+
+class ShardedIndex:
+    """Shards of source files served by worker processes, or by servers
+    on other hosts, which score reports by sending them to all shards
+    and merging the best files of shards.
+    """
+
+    __slots__ = ['scorers', 'top_k', 'bounds', 'local', 'managers', 'shards', 'executor',
+                 'vsm', 'idf', 'file_names']
+
+    def __init__(self, scorers=SCORERS, addresses=SHARD_ADDRESSES, top_k=TOP_K):
+        self.scorers = scorers
+        self.top_k = top_k
+        self.local = addresses is None
+        self.bounds = shard_bounds(corpus_store.n_src(),
+                                   N_SHARDS if self.local else len(addresses))
+
+        # Local workers inherit the random key of this process
+        authkey = None if self.local else shared_authkey()
+
+        # The word-vector table is exported once for all local workers,
+        # which only read it
+        if (self.local and 'semantic_similarity' in scorers
+                and semantic_similarity.USE_VECTOR_TABLE):
+            semantic_similarity.load_vectorizer(
+                corpus_store.load_src(semantic_similarity.SRC_COLUMNS), {})
+
+        self.managers = []
+        for address in addresses or [('127.0.0.1', 0)] * len(self.bounds):
+            manager = ShardManager(address, authkey)
+            if self.local:
+                manager.start()
+            else:
+                manager.connect()
+            self.managers.append(manager)
+
+        # The feature space of the index is the same for all shards
+        n_features = vsm_similarity.N_FEATURES if vsm_similarity.HASHED else None
+        self.vsm = vsm_similarity.Similarity(OrderedDict(), n_features)
+
+        # Each thread has its own connection, so shards work concurrently
+        self.executor = ThreadPoolExecutor(len(self.bounds))
+        self.shards = list(self.executor.map(
+            lambda manager, bounds: manager.ShardIndex(*bounds, scorers, n_features),
+            self.managers, self.bounds))
+
+        if 'vsm_similarity' in scorers:
+            self._gather_vsm_stats()
+
+        if 'stack_trace' in scorers:
+            self.file_names = set().union(*self._scatter('file_names'))
+
+    def _scatter(self, method, *args):
+        """Calling a method of all shards with the same arguments"""
+
+        return list(self.executor.map(lambda shard: getattr(shard, method)(*args),
+                                      self.shards))
+
+    def _gather_vsm_stats(self):
+        """Merging document frequencies of shards in the vocabulary of
+        the corpus, so all shards use the same idf.
+        """
+
+        stats = self._scatter('vsm_stats')
+        term_maps = [self.vsm.add_doc_freq(terms, doc_freq)
+                     for terms, doc_freq, *_ in stats]
+        _, _, n_docs, low, high = zip(*stats)
+
+        self.idf = vsm_similarity.inverse_doc_freq(self.vsm.doc_freq, sum(n_docs))
+
+        list(self.executor.map(
+            lambda shard, term_map: shard.set_vsm_stats(
+                None if self.vsm.n_features is not None else term_map,
+                self.idf, min(low), max(high)),
+            self.shards, term_maps))
+
+    def _merge(self, name, results):
+        """Full score rows of reports from the best files of shards"""
+
+        positions, scores, lows, highs = zip(*results)
+        n_reports = len(scores[0])
+
+        low, high = None, None
+        if name in _NORMALIZED:
+            low = np.min(lows, axis=0)[:, None]
+            high = np.max(highs, axis=0)[:, None]
+
+        rows = np.zeros((n_reports, self.bounds[-1][1]))
+        for (first, last), shard_positions, shard_scores in zip(self.bounds, positions, scores):
+            if low is not None:
+                shard_scores = score_store.min_max_rows(shard_scores, low, high)
+            if shard_positions is None:
+                rows[:, first:last] = shard_scores
+            else:
+                np.put_along_axis(rows[:, first:last], shard_positions, shard_scores, axis=1)
+
+        return rows
+
+    def _batch_scores(self, name, bug_reports, report_docs):
+        if name == 'vsm_similarity':
+            results = self._scatter('vsm_scores', self.vsm.report_tfidf(bug_reports, self.idf),
+                                    self.top_k)
+
+        elif name == 'token_matching':
+            matched = np.any(self._scatter('summary_matched', bug_reports), axis=0).tolist()
+            results = self._scatter('token_scores', bug_reports, matched, self.top_k)
+
+        elif name == 'stack_trace':
+            traces = [OrderedDict([(file, package) for file, package
+                                   in stack_trace.report_traces(report)
+                                   if file in self.file_names])
+                      for report in bug_reports.values()]
+            results = self._scatter('trace_scores', traces, self.top_k)
+
+        else:
+            results = self._scatter('semantic_scores', report_docs, self.top_k)
+
+        return self._merge(name, results)
+
+    def iter_scores(self, name, bug_reports, batch_size=BATCH_SIZE):
+        """Yielding the scores of a scorer for reports one by one"""
+
+        # Report vectors are computed once, without loading the
+        # vectors in each batch
+        report_docs = None
+        if name == 'semantic_similarity':
+            vectorizer = semantic_similarity.load_vectorizer({}, bug_reports)
+            report_docs = normalize_rows(
+                semantic_similarity.report_vectors(vectorizer, bug_reports))
+
+        reports = list(bug_reports.items())
+        for start in range(0, len(reports), batch_size):
+            yield from self._batch_scores(
+                name, OrderedDict(reports[start:start + batch_size]),
+                None if report_docs is None else report_docs[start:start + batch_size])
+
+    def close(self):
+        self.executor.shutdown()
+        if self.local:
+            for manager in self.managers:
+                manager.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def serve(host, port):
+    """Serving the shards which the scoring process builds on this host,
+    until the process is stopped.
+    """
+
+    manager = ShardManager((host, port), shared_authkey())
+
+    if not is_loopback(host):
+        print(f'Warning: anyone who can reach {host}:{port} and has the key can run code '
+              f'on this host, only serve on trusted networks (or tunnel a loopback port)')
+    print(f'Serving shards on {host}:{port}')
+    manager.get_server().serve_forever()
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        serve(sys.argv[2], int(sys.argv[3]))
+        return
+
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    start = time.perf_counter()
+    with ShardedIndex() as index:
+        build_time = time.perf_counter() - start
+        print(f'{len(index.shards)} shards built in {build_time:.2f}s')
+
+        for name in index.scorers:
+            start = time.perf_counter()
+            score_store.save_scores(name, index.iter_scores(name, bug_reports))
+            print(f'{name}: {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from evaluation import TOP_N, load_report_metrics
+
+# Number of paired bootstrap and randomization resamples
+N_RESAMPLES = 10000
+
+# Number of worker processes sharing the resamples
+N_WORKERS = os.cpu_count()
+
+# Confidence level of the intervals of metric differences
+CONFIDENCE = 0.95
+
+SEED = 458711526
+
+# Number of resamples drawn together in one matrix product,
+# with a seed of their own
+_BATCH_SIZE = 500
+
+METRIC_NAMES = ['MRR', 'MAP'] + [f'Top {n}' for n in TOP_N]
+
+
+def metric_matrix(recip_rank, avg_prec, hits):
+    """Per report metrics as columns of reciprocal rank, average
+    precision and whether files are found in the top N.
+    """
+
+    return np.column_stack([recip_rank, avg_prec, hits > 0]).astype(float)
+
+
+def _resample_means(diffs, method, blocks):
+    """Means of resampled differences of blocks of resamples, each block
+    given by its size and seed. A bootstrap resample weights reports by
+    their draw counts and a randomization resample swaps the paired
+    reports by flipping the signs of differences.
+    """
+
+    n_reports = len(diffs)
+
+    means = []
+    for size, seed in blocks:
+        rng = np.random.default_rng(seed)
+        if method == 'bootstrap':
+            weights = rng.multinomial(n_reports, np.full(n_reports, 1 / n_reports), size=size)
+        else:
+            weights = rng.choice((-1, 1), size=(size, n_reports))
+        means.append(weights @ diffs / n_reports)
+
+    return np.concatenate(means)
+
+
+def resample_means(diffs, method, n_resamples=N_RESAMPLES, n_workers=None):
+    """Resampling the differences in worker processes (N_WORKERS by
+    default). Each block of resamples has its own seed, so the resamples
+    don't depend on the number of workers sharing the blocks.
+    """
+
+    n_workers = N_WORKERS if n_workers is None else n_workers
+
+    sizes = [min(_BATCH_SIZE, n_resamples - start)
+             for start in range(0, n_resamples, _BATCH_SIZE)]
+    blocks = list(zip(sizes, np.random.SeedSequence(SEED).spawn(len(sizes))))
+
+    n_workers = min(n_workers, len(blocks))
+    if n_workers <= 1:
+        return _resample_means(diffs, method, blocks)
+
+    parts = [blocks[part[0]:part[-1] + 1]
+             for part in np.array_split(np.arange(len(blocks)), n_workers)]
+    with ProcessPoolExecutor(n_workers) as executor:
+        means = executor.map(_resample_means, [diffs] * n_workers, [method] * n_workers, parts)
+        return np.concatenate(list(means))
+
+
+def paired_test(metrics_a, metrics_b):
+    """Mean differences of per report metrics of two runs, with their
+    bootstrap confidence intervals, and bootstrap and randomization
+    p-values of no difference.
+    """
+
+    diffs = metrics_a - metrics_b
+    observed = diffs.mean(axis=0)
+
+    bootstrap = resample_means(diffs, 'bootstrap')
+    low, high = np.quantile(bootstrap, [(1 - CONFIDENCE) / 2, (1 + CONFIDENCE) / 2], axis=0)
+    bootstrap_p = (((np.abs(bootstrap - observed) >= np.abs(observed)).sum(axis=0) + 1)
+                   / (len(bootstrap) + 1))
+
+    randomization = resample_means(diffs, 'randomization')
+    randomization_p = (((np.abs(randomization) >= np.abs(observed)).sum(axis=0) + 1)
+                       / (len(randomization) + 1))
+
+    return observed, low, high, bootstrap_p, randomization_p
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('Usage: significance.py <output name> <output name>')
+        return
+
+    name_a, name_b = sys.argv[1:]
+    bug_ids_a, *metrics_a = load_report_metrics(name_a)
+    bug_ids_b, *metrics_b = load_report_metrics(name_b)
+
+    # Metrics are paired by report, so both runs need the same reports
+    # in the same order
+    if bug_ids_a is None or bug_ids_b is None:
+        print('The report ids of the metrics are not saved, evaluate the runs again')
+        return
+    if bug_ids_a != bug_ids_b:
+        print(f'{name_a} and {name_b} are evaluated on different reports')
+        return
+
+    metrics_a = metric_matrix(*metrics_a)
+    metrics_b = metric_matrix(*metrics_b)
+
+    start = time.perf_counter()
+    results = paired_test(metrics_a, metrics_b)
+    elapsed = time.perf_counter() - start
+
+    print(f'{name_a} vs {name_b}, {len(metrics_a)} reports, '
+          f'{N_RESAMPLES} resamples in {elapsed:.2f}s')
+    for i, metric in enumerate(METRIC_NAMES):
+        diff, low, high, bootstrap_p, randomization_p = (result[i] for result in results)
+        print(f'{metric}: {metrics_a[:, i].mean():.4f} vs {metrics_b[:, i].mean():.4f}, '
+              f'diff {diff:+.4f} [{low:+.4f}, {high:+.4f}], '
+              f'p bootstrap {bootstrap_p:.4f}, p randomization {randomization_p:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,68 +1,131 @@
-import json
 import pickle
 from collections import OrderedDict
 
+import numpy as np
+
+import artifacts
+import corpus_store
+import score_store
 from datasets import DATASET
 
 
-def get_traces_score(src_files, bug_reports):
+def report_traces(report):
+    """File names and packages of the stack traces of a report"""
+
+    # Preprocessing stack-traces
+    final_st = []
+    for trace in report.stack_traces:
+        if trace[1] == 'Unknown Source':
+            final_st.append(
+                (trace[0].split('.')[-2].split('$')[0], trace[0].strip()))
+        elif trace[1] != 'Native Method':
+            final_st.append(
+                (trace[1].split('.')[0].replace(' ', ''), trace[0].strip()))
+
+    return final_st
+
+
+class TraceIndex:
+    """Index of source files by their exact file name, which can be
+    updated in place.
+    """
+
+    INDEX_FILE = 'trace_index.pickle'
+
+    # Columns of preprocessed source files needed to build the index
+    SRC_COLUMNS = ['exact_file_name', 'package_name']
+
+    __slots__ = ['src_names', '_by_name']
+
+    def __init__(self, src_files):
+        self.src_names = OrderedDict()
+        self.update(src_files)
+
+    def update(self, changed, deleted=()):
+        """Adding or replacing the changed source files and removing
+        the deleted ones, the index is built again when needed.
+        """
+
+        for src_id in deleted:
+            del self.src_names[src_id]
 
-    all_file_names = set(s.exact_file_name for s in src_files.values())
+        for src_id, src in changed.items():
+            self.src_names[src_id] = (src.exact_file_name, src.package_name)
 
-    all_scores = []
-    for report in bug_reports.values():
+        self._by_name = None
 
-        scores = []
+    @property
+    def by_name(self):
+        """Positions and package names of source files by file name"""
 
-        stack_traces = report.stack_traces
+        if self._by_name is None:
+            self._by_name = {}
+            for i, (file_name, package_name) in enumerate(self.src_names.values()):
+                self._by_name.setdefault(file_name, []).append((i, package_name))
 
-        # Preprocessing stack-traces
-        final_st = []
-        for trace in stack_traces:
-            if trace[1] == 'Unknown Source':
-                final_st.append(
-                    (trace[0].split('.')[-2].split('$')[0], trace[0].strip()))
-            elif trace[1] != 'Native Method':
-                final_st.append(
-                    (trace[1].split('.')[0].replace(' ', ''), trace[0].strip()))
+        return self._by_name
 
-        stack_traces = OrderedDict([(file, package) for file, package in final_st
-                                    if file in all_file_names])
+    def iter_traces_score(self, bug_reports):
+        """Yielding the stack trace scores of reports one by one"""
 
-        for src in src_files.values():
-            file_name = src.exact_file_name
+        for report in bug_reports.values():
+            stack_traces = OrderedDict([(file, package) for file, package
+                                        in report_traces(report) if file in self.by_name])
 
-            # If the source file has a package name
-            if src.package_name:
-                if file_name in stack_traces and src.package_name in stack_traces[file_name]:
-                    scores.append(
-                        1 / (list(stack_traces).index(file_name) + 1))
+            yield self.trace_scores(stack_traces)
 
-                else:
-                    # If it isn't the exact source file based on it's package name
-                    scores.append(0)
-            # If it doesn't have a package name
-            elif file_name in stack_traces:
-                scores.append(1 / (list(stack_traces).index(file_name) + 1))
-            else:
-                scores.append(0)
+    def trace_scores(self, stack_traces):
+        """Scores of source files by the rank of their file name in the
+        stack traces, which are only the files found in the codebase.
+        """
 
-        all_scores.append(scores)
+        scores = np.zeros(len(self.src_names))
 
-    return all_scores
+        for rank, (file_name, package) in enumerate(stack_traces.items()):
+            for i, package_name in self.by_name.get(file_name, ()):
+
+                # If the source file has a package name, it should be
+                # the exact source file based on it's package name
+                if not package_name or package_name in package:
+                    scores[i] = 1 / (rank + 1)
+
+        return scores
+
+    def get_traces_score(self, bug_reports):
+        return list(self.iter_traces_score(bug_reports))
+
+    def save(self):
+        with open(DATASET.root / self.INDEX_FILE, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, src_files):
+        """Loading the saved index, building it if there isn't one"""
+
+        index_path = DATASET.root / cls.INDEX_FILE
+
+        if index_path.exists():
+            with open(index_path, 'rb') as file:
+                return pickle.load(file)
+
+        index = cls(src_files)
+        index.save()
+
+        return index
+
+
+def get_traces_score(src_files, bug_reports):
+    return TraceIndex(src_files).get_traces_score(bug_reports)
 
 
 def main():
 
-    with open(DATASET.root / 'preprocessed_src.pickle', 'rb') as file:
-        src_files = pickle.load(file)
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'rb') as file:
-        bug_reports = pickle.load(file)
+    src_files = corpus_store.load_src(TraceIndex.SRC_COLUMNS)
+    bug_reports = artifacts.load('preprocessed_reports')
 
-    all_scores = get_traces_score(src_files, bug_reports)
+    all_scores = TraceIndex.load(src_files).iter_traces_score(bug_reports)
 
-    with open(DATASET.root / 'stack_trace.json', 'w') as file:
-        json.dump(all_scores, file)
+    score_store.save_scores('stack_trace', all_scores)
 
 
 if __name__ == '__main__':
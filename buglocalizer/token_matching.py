@@ -1,78 +1,174 @@
-import json
 import pickle
+from collections import OrderedDict
 
 import numpy as np
-from sklearn import preprocessing
+from scipy import sparse
 
+import artifacts
+import corpus_store
+import score_store
 from datasets import DATASET
 
 
-def check_matchings(src_files, bug_reports):
-    """Checking the matching tokens between bug reports and source files"""
+class TokenIndex:
+    """Binary term matrices of source file names, comments and attributes,
+    which can be updated in place.
+    """
+
+    INDEX_FILE = 'token_index.pickle'
+
+    # Columns of preprocessed source files needed to build the index
+    SRC_COLUMNS = ['file_name.stemmed', 'class_names.stemmed', 'method_names.stemmed',
+                   'comments.stemmed', 'attributes.stemmed']
+
+    __slots__ = ['vocabulary', 'src_terms', '_matrices']
+
+    def __init__(self, src_files):
+        self.vocabulary = {}
+        self.src_terms = OrderedDict()
+        self.update(src_files)
+
+    def _term_ids(self, tokens):
+        return [self.vocabulary.setdefault(token, len(self.vocabulary))
+                for token in set(tokens)]
+
+    def update(self, changed, deleted=()):
+        """Adding or replacing the changed source files and removing
+        the deleted ones, the matrices are built again when needed.
+        """
+
+        for src_id in deleted:
+            del self.src_terms[src_id]
+
+        for src_id, src in changed.items():
+            file_name = src.file_name['stemmed']
+            self.src_terms[src_id] = (
+                self._term_ids(file_name[:1])[0] if file_name else -1,
+                self._term_ids(src.file_name['stemmed'] + src.class_names['stemmed']
+                               + src.method_names['stemmed']),
+                self._term_ids(src.comments['stemmed']),
+                self._term_ids(src.attributes['stemmed']),
+            )
+
+        self._matrices = None
+
+    @property
+    def matrices(self):
+        """First file name tokens, and the names, comments and
+        attributes term matrices with their number of terms.
+        """
+
+        if self._matrices is None:
+            src_terms = list(self.src_terms.values())
+            first_names = np.array([terms[0] for terms in src_terms], dtype=np.int64)
+
+            term_matrices = []
+            for field in (1, 2, 3):
+                field_terms = [terms[field] for terms in src_terms]
+                indptr = np.cumsum([0] + [len(term_ids) for term_ids in field_terms])
+                indices = np.array([term_id for term_ids in field_terms
+                                    for term_id in term_ids], dtype=np.int64)
+                matrix = sparse.csr_matrix(
+                    (np.ones(len(indices)), indices, indptr),
+                    shape=(len(src_terms), len(self.vocabulary))
+                )
+                term_matrices.append((matrix, np.diff(indptr)))
+
+            self._matrices = (first_names, *term_matrices)
+
+        return self._matrices
+
+    def _query(self, tokens):
+        """Indicator vector of the tokens in the vocabulary"""
 
-    scores = []
-    for report in bug_reports.values():
-        matched_count = []
-        summary_set = report.summary
-        pos_tagged_sum_desc = (report.pos_tagged_summary['stemmed'] +
-                               report.pos_tagged_description['stemmed'])
+        query = np.zeros(len(self.vocabulary))
+        query[[self.vocabulary[token] for token in set(tokens)
+               if token in self.vocabulary]] = 1
 
-        for src in src_files.values():
-            if src.file_name['stemmed']:
-                common_tokens = len(set(summary_set['stemmed']) &
-                                    set([src.file_name['stemmed'][0]]))
-            else:
-                common_tokens = 0
+        return query
 
-            matched_count.append(common_tokens)
+    def iter_matchings(self, bug_reports):
+        """Checking the matching tokens between bug reports and source files,
+        yielding the scores of reports one by one.
+        """
 
-        # Here no files matched a summary
-        if sum(matched_count) == 0:
-            matched_count = []
-            for src in src_files.values():
-                common_tokens = len(set(pos_tagged_sum_desc) &
-                                    set(src.file_name['stemmed'] +
-                                        src.class_names['stemmed'] +
-                                        src.method_names['stemmed']))
+        for report in bug_reports.values():
+            matched_count = self.summary_matches(report)
 
-                if not common_tokens:
-                    common_tokens = (len(set(pos_tagged_sum_desc) &
-                                         set(src.comments['stemmed']))
-                                     - len(set(src.comments['stemmed'])))
+            # Here no files matched a summary
+            if matched_count.sum() == 0:
+                matched_count = self.token_matches(report)
 
-                if not common_tokens:
-                    common_tokens = (len(set(pos_tagged_sum_desc) &
-                                         set(src.attributes['stemmed']))
-                                     - len(set(src.attributes['stemmed'])))
+            yield score_store.min_max_rows(matched_count)
 
-                matched_count.append(common_tokens)
+    def summary_matches(self, report):
+        """Source files whose first file name token is in the summary"""
 
-        min_max_scaler = preprocessing.MinMaxScaler()
+        summary_ids = [self.vocabulary[token] for token in set(report.summary['stemmed'])
+                       if token in self.vocabulary]
 
-        intersect_count = np.array([float(count)
-                                    for count in matched_count]).reshape(-1, 1)
-        normalized_count = np.concatenate(
-            min_max_scaler.fit_transform(intersect_count)
-        )
+        return np.isin(self.matrices[0], summary_ids).astype(float)
 
-        scores.append(normalized_count.tolist())
+    def token_matches(self, report):
+        """Number of report tokens matching the names of source files,
+        or their comments and attributes if their names don't match.
+        """
+
+        _, names, comments, attributes = self.matrices
+
+        query = self._query(report.pos_tagged_summary['stemmed'] +
+                            report.pos_tagged_description['stemmed'])
+
+        matched_count = names[0] @ query
+
+        for matrix, n_terms in (comments, attributes):
+            unmatched = matched_count == 0
+            matched_count[unmatched] = (matrix[unmatched] @ query
+                                        - n_terms[unmatched])
+
+        return matched_count
+
+    def check_matchings(self, bug_reports):
+        """Checking the matching tokens between bug reports and source files"""
+
+        return list(self.iter_matchings(bug_reports))
+
+    def save(self):
+        with open(DATASET.root / self.INDEX_FILE, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, src_files):
+        """Loading the saved index, building it if there isn't one"""
+
+        index_path = DATASET.root / cls.INDEX_FILE
+
+        if index_path.exists():
+            with open(index_path, 'rb') as file:
+                return pickle.load(file)
+
+        index = cls(src_files)
+        index.save()
+
+        return index
+
+
+def check_matchings(src_files, bug_reports):
+    """Checking the matching tokens between bug reports and source files"""
 
-    return scores
+    return TokenIndex(src_files).check_matchings(bug_reports)
 
 
 def main():
 
     # Unpickle preprocessed data
-    with open(DATASET.root / 'preprocessed_src.pickle', 'rb') as file:
-        src_files = pickle.load(file)
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'rb') as file:
-        bug_reports = pickle.load(file)
+    src_files = corpus_store.load_src(TokenIndex.SRC_COLUMNS)
+    bug_reports = artifacts.load('preprocessed_reports')
 
-    scores = check_matchings(src_files, bug_reports)
+    scores = TokenIndex.load(src_files).iter_matchings(bug_reports)
 
-    # Saving scores in a json file
-    with open(DATASET.root / 'token_matching.json', 'w') as file:
-        json.dump(scores, file)
+    # Saving scores in the score store as they are computed
+    score_store.save_scores('token_matching', scores)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,109 @@
+import os.path
+import sys
+import time
+
+import artifacts
+import corpus_store
+import semantic_similarity
+from datasets import DATASET
+from parsers import Parser
+from preprocessing import SrcPreprocessing
+from stack_trace import TraceIndex
+from token_matching import TokenIndex
+from vsm_similarity import Similarity
+
+
+def find_src_id(src_files, path):
+    """Id of an existing source file based on its path"""
+
+    if DATASET.name == 'aspectj':
+        src_id = os.path.relpath(path, start=DATASET.src)
+        return src_id if src_id in src_files else None
+
+    # Ids are the package names followed by the file names,
+    # where packages match the directories of files
+    directory, file_name = os.path.split(os.path.relpath(path, start=DATASET.src))
+    package_path = '.' + directory.replace(os.sep, '.')
+
+    for src_id in src_files:
+        if src_id == file_name:
+            return src_id
+        if (src_id.endswith('.' + file_name)
+                and package_path.endswith('.' + src_id[:-len(file_name) - 1])):
+            return src_id
+
+    return None
+
+
+def update_sources(added, modified, deleted):
+    """Updating the preprocessed source files and their indexes with
+    the added, modified and deleted source files.
+    """
+
+    src_files = artifacts.load('preprocessed_src')
+
+    # Saved indexes are loaded before the source files change, so an index
+    # which is rebuilt in the configured feature space holds the files it
+    # updates. Indexes which are not built yet are built when needed
+    indexes = [index_class.load(src_files) for index_class in (Similarity, TokenIndex, TraceIndex)
+               if (DATASET.root / index_class.INDEX_FILE).exists()]
+
+    removed = [find_src_id(src_files, DATASET.src / path)
+               for path in modified + deleted]
+
+    parser = Parser(DATASET)
+    src_prep = SrcPreprocessing(parser.src_parser(
+        [str(DATASET.src / path) for path in added + modified]))
+    src_prep.preprocess()
+    changed = src_prep.src_files
+
+    # Modified files with the same id are replaced in place
+    deleted_ids = [src_id for src_id in dict.fromkeys(removed)
+                   if src_id is not None and src_id not in changed]
+
+    for src_id in deleted_ids:
+        del src_files[src_id]
+    src_files.update(changed)
+
+    artifacts.save('preprocessed_src', src_files)
+    corpus_store.save_src(src_files)
+
+    for index in indexes:
+        index.update(changed, deleted_ids)
+        index.save()
+
+    semantic_similarity.update_src_vectors(src_files, changed)
+
+
+def main():
+    """Reading the changed files in the format of `git diff --name-status`
+    from the standard input, with paths relative to the source directory.
+    """
+
+    added, modified, deleted = [], [], []
+    for line in sys.stdin:
+        status, *paths = line.split('\t')
+        paths = [path.strip() for path in paths]
+
+        if not paths[-1].endswith('.java'):
+            continue
+
+        if status.startswith('A'):
+            added.append(paths[0])
+        elif status.startswith('M'):
+            modified.append(paths[0])
+        elif status.startswith('D'):
+            deleted.append(paths[0])
+        elif status.startswith('R'):
+            deleted.append(paths[0])
+            added.append(paths[1])
+
+    start = time.perf_counter()
+    update_sources(added, modified, deleted)
+
+    print(f'Updated {len(added)} added, {len(modified)} modified and '
+          f'{len(deleted)} deleted files in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
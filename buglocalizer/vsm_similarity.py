@@ -1,84 +1,321 @@
-import json
 import pickle
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
 
 import numpy as np
-from sklearn import preprocessing
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from sklearn.utils import murmurhash3_32
 
+import artifacts
+import corpus_store
+import score_store
 from datasets import DATASET
 
+# Hashing terms into a fixed number of features instead of keeping
+# a vocabulary of all terms of the corpus
+HASHED = False
+N_FEATURES = 2 ** 20
+
+
+# Tokenizer of tf-idf vectorizers to find terms of documents
+_analyze = TfidfVectorizer().build_analyzer()
+
+
+def inverse_doc_freq(doc_freq, n_docs):
+    """Inverse document frequency of terms (zero for unused terms)"""
+
+    idf = np.zeros(len(doc_freq))
+    used = doc_freq > 0
+    idf[used] = np.log(n_docs / doc_freq[used]) + 1
+
+    return idf
+
+
+def sublinear_tfidf(term_counts, idf):
+    """Sublinear tf-idf matrix normalized by the length of rows"""
+
+    indptr = np.cumsum([0] + [len(term_ids) for term_ids, _ in term_counts])
+    indices = np.concatenate([term_ids for term_ids, _ in term_counts]
+                             + [np.zeros(0, dtype=np.int64)])
+    data = np.concatenate([counts for _, counts in term_counts] + [np.zeros(0)])
+
+    data = (1 + np.log(data)) * idf[indices]
+    tfidf = sparse.csr_matrix((data, indices, indptr),
+                              shape=(len(term_counts), len(idf)))
+
+    return normalize(tfidf)
+
+
+def length_scores(lengths, low=None, high=None):
+    """Logistic function of the normalized length of source files, where
+    the lengths can be normalized by the range of a larger corpus.
+    """
+
+    normalized_src_len = score_store.min_max_rows(lengths, low, high)
+
+    return 1 / (1 + np.exp(-12 * normalized_src_len))
+
+
+def rvsm_scores(reports_tfidf, src_tfidf, src_len_score):
+    """Revised VSM scores of a block of reports before normalization"""
+
+    return cosine_similarity(reports_tfidf, src_tfidf) * src_len_score
+
 
 class Similarity:
+    """The tf-idf index of source files, which can be updated in place
+    and is kept to score new bug reports later.
+    """
 
-    __slots__ = ['src_files', 'src_strings']
+    INDEX_FILE = 'vsm_index.pickle'
 
-    def __init__(self, src_files):
-        self.src_files = src_files
-        self.src_strings = [' '.join(src.file_name['stemmed'] + src.class_names['stemmed']
-                                     + src.method_names['stemmed']
-                                     + src.pos_tagged_comments['stemmed']
-                                     + src.attributes['stemmed'])
-                            for src in self.src_files.values()]
+    # Columns of preprocessed source files needed to build the index
+    SRC_COLUMNS = ['file_name.stemmed', 'class_names.stemmed', 'method_names.stemmed',
+                   'pos_tagged_comments.stemmed', 'attributes.stemmed']
 
-    def calculate_similarity(self, src_tfidf, reports_tfidf):
-        """Calculatnig cosine similarity between source files and bug reports"""
+    __slots__ = ['vocabulary', 'n_features', 'doc_freq', 'src_terms',
+                 '_src_tfidf', '_src_len_score']
 
-        # Normalizing the length of source files
-        src_lenghts = np.array([float(len(src_str.split()))
-                                for src_str in self.src_strings]).reshape(-1, 1)
-        min_max_scaler = preprocessing.MinMaxScaler()
-        normalized_src_len = min_max_scaler.fit_transform(src_lenghts)
+    def __init__(self, src_files, n_features=None):
+        self.vocabulary = {}
+        self.n_features = n_features
+        self.doc_freq = np.zeros(n_features or 0, dtype=np.int64)
+        self.src_terms = OrderedDict()
+        self.update(src_files)
 
-        # Applying logistic length function
-        src_len_score = 1 / (1 + np.exp(-12 * normalized_src_len))
+    @staticmethod
+    def _src_string(src):
+        return ' '.join(src.file_name['stemmed'] + src.class_names['stemmed']
+                        + src.method_names['stemmed']
+                        + src.pos_tagged_comments['stemmed']
+                        + src.attributes['stemmed'])
 
-        simis = []
-        for report in reports_tfidf:
-            s = cosine_similarity(src_tfidf, report)
+    def _grow_doc_freq(self):
+        if len(self.vocabulary) > len(self.doc_freq):
+            self.doc_freq = np.concatenate((
+                self.doc_freq,
+                np.zeros(len(self.vocabulary) - len(self.doc_freq), dtype=np.int64)))
 
-            # revised VSM score calculation
-            rvsm_score = s * src_len_score
+    def _count_terms(self, string, grow=False):
+        """Ids and counts of the terms of a string in the vocabulary,
+        or of their hashed features.
+        """
 
-            normalized_score = np.concatenate(
-                min_max_scaler.fit_transform(rvsm_score)
-            )
+        counts = Counter(_analyze(string))
 
-            simis.append(normalized_score.tolist())
+        if self.n_features is not None:
+            # Terms hashed to the same feature are counted together
+            features = Counter()
+            for term, count in counts.items():
+                features[murmurhash3_32(term, positive=True) % self.n_features] += count
+            known = list(features.items())
 
-        return simis
+        else:
+            if grow:
+                for term in counts:
+                    self.vocabulary.setdefault(term, len(self.vocabulary))
+                self._grow_doc_freq()
 
-    def find_similars(self, bug_reports):
-        """Calculating tf-idf vectors for source and report sets
-        to find similar source files for each bug report.
+            known = [(self.vocabulary[term], count) for term, count in counts.items()
+                     if term in self.vocabulary]
+        term_ids, term_counts = zip(*known) if known else ((), ())
+
+        return np.array(term_ids, dtype=np.int64), np.array(term_counts, dtype=float)
+
+    def update(self, changed, deleted=()):
+        """Adding or replacing the changed source files and removing the
+        deleted ones, the weights are computed again when needed.
+        """
+
+        for src_id in deleted:
+            term_ids, _, _ = self.src_terms.pop(src_id)
+            self.doc_freq[term_ids] -= 1
+
+        for src_id, src in changed.items():
+            if src_id in self.src_terms:
+                self.doc_freq[self.src_terms[src_id][0]] -= 1
+
+            src_string = self._src_string(src)
+            term_ids, term_counts = self._count_terms(src_string, grow=True)
+            self.doc_freq[term_ids] += 1
+
+            self.src_terms[src_id] = (term_ids, term_counts, len(src_string.split()))
+
+        self._src_tfidf = None
+        self._src_len_score = None
+
+    def merge(self, other):
+        """Adding the source files of another index, like a shard of
+        the codebase indexed separately.
+        """
+
+        if other.n_features != self.n_features:
+            raise ValueError('Indexes have different feature spaces')
+
+        term_map = self.add_doc_freq(list(other.vocabulary), other.doc_freq)
+
+        for src_id, (term_ids, term_counts, length) in other.src_terms.items():
+            if src_id in self.src_terms:
+                self.doc_freq[self.src_terms[src_id][0]] -= 1
+            if self.n_features is None:
+                term_ids = term_map[term_ids]
+            self.src_terms[src_id] = (term_ids, term_counts, length)
+
+        self._src_tfidf = None
+        self._src_len_score = None
+
+    def add_doc_freq(self, terms, doc_freq):
+        """Adding the document frequencies of the terms of another
+        vocabulary (or of the hashed features), returning the ids of
+        the terms in this vocabulary.
+        """
+
+        # Mapping the term ids of the other vocabulary to this one
+        term_map = np.array([self.vocabulary.setdefault(term, len(self.vocabulary))
+                             for term in terms], dtype=np.int64)
+        self._grow_doc_freq()
+
+        if self.n_features is None:
+            self.doc_freq[term_map] += doc_freq
+        else:
+            self.doc_freq += doc_freq
+
+        return term_map
+
+    def _idf(self):
+        return inverse_doc_freq(self.doc_freq, len(self.src_terms))
+
+    @property
+    def src_tfidf(self):
+        if self._src_tfidf is None:
+            self._src_tfidf = sublinear_tfidf(
+                [(term_ids, counts) for term_ids, counts, _ in self.src_terms.values()],
+                self._idf())
+
+        return self._src_tfidf
+
+    @property
+    def src_len_score(self):
+        if self._src_len_score is None:
+            self._src_len_score = length_scores(
+                [length for _, _, length in self.src_terms.values()])
+
+        return self._src_len_score
+
+    def calculate_similarity(self, reports_tfidf, block_size=None):
+        """Calculatnig cosine similarity between source files and bug reports,
+        yielding the scores of reports one by one.
+        """
+
+        block_size = score_store.CHUNK_SIZE if block_size is None else block_size
+
+        for start in range(0, reports_tfidf.shape[0], block_size):
+            rvsm_score = rvsm_scores(reports_tfidf[start:start + block_size],
+                                     self.src_tfidf, self.src_len_score)
+
+            yield from score_store.min_max_rows(rvsm_score)
+
+    def report_tfidf(self, bug_reports, idf=None):
+        """Tf-idf vectors of bug reports in the vocabulary of the index,
+        weighted by the given idf of a larger corpus if there is one.
         """
 
         reports_strings = [' '.join(report.summary['stemmed'] + report.description['stemmed'])
                            for report in bug_reports.values()]
 
-        tfidf = TfidfVectorizer(sublinear_tf=True, smooth_idf=False)
-        src_tfidf = tfidf.fit_transform(self.src_strings)
+        return sublinear_tfidf([self._count_terms(string) for string in reports_strings],
+                               self._idf() if idf is None else idf)
+
+    def iter_similars(self, bug_reports):
+        """Calculating tf-idf vectors for source and report sets
+        to find similar source files for each bug report.
+        """
+
+        return self.calculate_similarity(self.report_tfidf(bug_reports))
+
+    def find_similars(self, bug_reports):
+        return list(self.iter_similars(bug_reports))
+
+    def save(self):
+        with open(DATASET.root / self.INDEX_FILE, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, src_files):
+        """Loading the saved index, building it if there isn't one
+        in the configured feature space.
+        """
+
+        index_path = DATASET.root / cls.INDEX_FILE
+        n_features = N_FEATURES if HASHED else None
+
+        if index_path.exists():
+            with open(index_path, 'rb') as file:
+                index = pickle.load(file)
+            if index.n_features == n_features:
+                return index
+
+        index = cls(src_files, n_features)
+        index.save()
+
+        return index
+
+
+def benchmark(n_features=N_FEATURES):
+    """Comparing the memory, speed and accuracy of the hashed tf-idf
+    against the exact vocabulary.
+    """
+
+    import evaluation
+
+    src_files = artifacts.load('preprocessed_src')
+    bug_reports = artifacts.load('preprocessed_reports')
+    relevance = evaluation.relevant_files(src_files, bug_reports)
+
+    results = {}
+    for name, features in (('vocabulary', None), ('hashed', n_features)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        index = Similarity(src_files, features)
+        index.src_tfidf
+        build_time = time.perf_counter() - start
+        build_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        scores = np.array(index.find_similars(bug_reports))
+        score_time = time.perf_counter() - start
+
+        mrr, mean_avgp, *_ = evaluation.block_metrics(relevance, [(0, scores)])
+
+        results[name] = (build_time, score_time, build_memory,
+                         len(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)),
+                         np.mean(mrr), np.mean(mean_avgp), scores)
 
-        reports_tfidf = tfidf.transform(reports_strings)
+    for name, (build_time, score_time, memory, size, mrr, mean_avgp, _) in results.items():
+        print(f'{name}: build {build_time:.2f}s, scoring {score_time:.2f}s, '
+              f'peak memory {memory / 2 ** 20:.1f} MiB, index {size / 2 ** 20:.1f} MiB, '
+              f'MRR {mrr:.4f}, MAP {mean_avgp:.4f}')
 
-        simis = self.calculate_similarity(src_tfidf, reports_tfidf)
-        return simis
+    print('Max score difference:',
+          np.abs(results['vocabulary'][-1] - results['hashed'][-1]).max())
 
 
 def main():
 
     # Unpickle preprocessed data
-    with open(DATASET.root / 'preprocessed_src.pickle', 'rb') as file:
-        src_files = pickle.load(file)
-    with open(DATASET.root / 'preprocessed_reports.pickle', 'rb') as file:
-        bug_reports = pickle.load(file)
+    src_files = corpus_store.load_src(Similarity.SRC_COLUMNS)
+    bug_reports = artifacts.load('preprocessed_reports')
 
-    sm = Similarity(src_files)
-    simis = sm.find_similars(bug_reports)
+    sm = Similarity.load(src_files)
+    simis = sm.iter_similars(bug_reports)
 
-    # Saving similarities in a json file
-    with open(DATASET.root / 'vsm_similarity.json', 'w') as file:
-        json.dump(simis, file)
+    # Saving similarities in the score store as they are computed
+    score_store.save_scores('vsm_similarity', simis)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,198 @@
+import json
+
+import numpy as np
+
+from datasets import DATASET
+
+# spaCy model whose word vectors are used
+MODEL = 'en_core_web_lg'
+
+VECTORS_FILE = 'word_vectors.npy'
+VOCAB_FILE = 'word_vectors_vocab.json'
+
+
+def _load_model():
+    import spacy
+
+    return spacy.load(MODEL)
+
+
+def model_id(nlp):
+    """Name and version of a loaded spaCy model"""
+
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+
+
+class SpacyVectors:
+    """Document vectors computed by the loaded spaCy model"""
+
+    __slots__ = ['nlp']
+
+    def __init__(self, nlp=None):
+        self.nlp = _load_model() if nlp is None else nlp
+
+    @property
+    def size(self):
+        return self.nlp.vocab.vectors_length
+
+    @property
+    def digest(self):
+        """Model and size of the vectors, which vectors computed
+        before are checked against
+        """
+
+        return f'spacy:{model_id(self.nlp)}:{self.size}'
+
+    def doc_vector(self, words):
+        return self.nlp.make_doc(' '.join(words)).vector
+
+
+class WordVectors:
+    """Word vectors of the corpus vocabulary, memory-mapped so processes
+    share them read-only. Each row holds the sum of vectors of the spaCy
+    tokens of a word and the number of tokens, so averaging them over a
+    document gives its spaCy document vector.
+    """
+
+    __slots__ = ['rows', 'vectors', 'counts', 'model']
+
+    def __init__(self, words, vectors, counts, model):
+        self.rows = {word: i for i, word in enumerate(words)}
+        self.vectors = vectors
+        self.counts = counts
+        self.model = model
+
+    @property
+    def size(self):
+        return self.vectors.shape[1]
+
+    @property
+    def digest(self):
+        """Model which exported the table and size of the vectors,
+        which vectors computed before are checked against
+        """
+
+        return f'table:{self.model}:{self.size}'
+
+    def doc_vector(self, words):
+        ids = [self.rows[word] for word in words]
+        if not ids:
+            return np.zeros(self.size, dtype=np.float32)
+
+        return self.vectors[ids].sum(axis=0) / self.counts[ids].sum()
+
+    @staticmethod
+    def export(words, nlp=None):
+        """Saving the vectors of words, keeping the ones already saved
+        by the same model
+        """
+
+        vectors_path = DATASET.root / VECTORS_FILE
+        vocab_path = DATASET.root / VOCAB_FILE
+
+        old_words, old_vectors, old_counts, old_model = [], None, [], None
+        if vocab_path.exists():
+            with open(vocab_path, 'r') as file:
+                vocab = json.load(file)
+            old_words, old_counts, old_model = vocab['words'], vocab['counts'], vocab['model']
+            old_vectors = np.load(vectors_path)
+
+        words = set(words)
+        known = set(old_words)
+        new_words = sorted(word for word in words if word not in known)
+        if not new_words and old_vectors is not None:
+            return
+
+        nlp = _load_model() if nlp is None else nlp
+
+        # Vectors of another version of the model are exported again
+        if old_model != model_id(nlp):
+            old_words, old_vectors, old_counts = [], None, []
+            new_words = sorted(words)
+
+        vectors = np.zeros((len(new_words), nlp.vocab.vectors_length), dtype=np.float32)
+        counts = []
+        for i, word in enumerate(new_words):
+            doc = nlp.make_doc(word)
+            for token in doc:
+                vectors[i] += token.vector
+            counts.append(len(doc))
+
+        if old_vectors is not None:
+            vectors = np.concatenate((old_vectors, vectors))
+
+        # Replacing the files instead of writing over them, as other
+        # processes may have mapped them
+        tmp_path = vectors_path.with_suffix('.tmp.npy')
+        np.save(tmp_path, vectors)
+        tmp_path.replace(vectors_path)
+
+        tmp_path = vocab_path.with_suffix('.tmp.json')
+        with open(tmp_path, 'w') as file:
+            json.dump({'words': old_words + new_words, 'counts': old_counts + counts,
+                       'model': model_id(nlp)}, file)
+        tmp_path.replace(vocab_path)
+
+    @classmethod
+    def load(cls, words=(), export=True):
+        """Loading the saved table, exporting the given words which
+        aren't in it yet. Without exporting, a missing table or one
+        without the words raises ValueError, so processes sharing the
+        table never write it at the same time.
+        """
+
+        vocab_path = DATASET.root / VOCAB_FILE
+
+        stale = missing = True
+        if vocab_path.exists():
+            with open(vocab_path, 'r') as file:
+                vocab = json.load(file)
+
+            # A table of another model is exported again
+            stale = vocab['model'].rpartition('-')[0] != MODEL
+            rows = set(vocab['words'])
+            missing = stale or any(word not in rows for word in words)
+
+        if missing and not export:
+            raise ValueError(f'The word-vector table of {MODEL} in {DATASET.root} is missing '
+                             f'or lacks words, export it with word_vectors.py')
+
+        if stale:
+            vocab_path.unlink(missing_ok=True)
+        if missing:
+            cls.export(words)
+
+        with open(vocab_path, 'r') as file:
+            vocab = json.load(file)
+
+        return cls(vocab['words'], np.load(DATASET.root / VECTORS_FILE, mmap_mode='r'),
+                   np.array(vocab['counts'], dtype=np.float32), vocab['model'])
+
+
+def main():
+    import artifacts
+    import semantic_similarity
+
+    src_files = artifacts.load('preprocessed_src')
+    bug_reports = artifacts.load('preprocessed_reports')
+
+    docs = ([semantic_similarity.src_words(src) for src in src_files.values()]
+            + [semantic_similarity.report_words(report) for report in bug_reports.values()])
+
+    # Exporting the complete vocabulary of the corpus again
+    (DATASET.root / VOCAB_FILE).unlink(missing_ok=True)
+    nlp = _load_model()
+    WordVectors.export((word for words in docs for word in words), nlp)
+
+    table = WordVectors.load()
+    model = SpacyVectors(nlp)
+
+    # Checking the table against the document vectors of spaCy
+    max_diff = max((np.abs(table.doc_vector(words) - model.doc_vector(words)).max()
+                    for words in docs), default=0)
+
+    print(f'{len(table.rows)} words exported, max difference to spaCy: {max_diff:.2e}')
+
+
+if __name__ == '__main__':
+    main()